@@ -0,0 +1,165 @@
+"""
+asyncio mode of the API gateway, started by entrypoint.sh when GATEWAY_MODE=asyncio.
+
+One event loop serves every request with aiohttp, so a request waiting on
+an upstream holds no thread and the gateway's concurrency is bounded by the
+upstream connection pools rather than by worker threads. It serves the same
+routes as controller.py: the proxied APIs as streaming passthroughs, the
+proximity query over a grpc.aio channel, the person overview with its calls
+issued concurrently, and the documentation routes.
+
+Upstream hosts, pool sizes and timeouts are the ones in upstreams.py.
+"""
+import asyncio
+import logging
+import os
+
+import grpc
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
+
+import controller
+import overview
+import upstreams
+from modules.connections import location_connection_pb2
+from modules.connections import location_connection_pb2_grpc
+from openapi_aggregator import get_aggregated_spec
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+GATEWAY_PORT = int(os.environ.get("GATEWAY_PORT", "5002"))
+
+
+def _upstream_error(e):
+    if isinstance(e, asyncio.TimeoutError):
+        return web.json_response({"error": f"Upstream timed out: {e}"}, status=504)
+    return web.json_response({"error": f"Upstream unavailable: {e}"}, status=502)
+
+
+async def _passthrough(request, name, path):
+    """Relay the request and stream the upstream status, headers and raw body back unchanged."""
+    upstream = upstreams.HTTP_UPSTREAMS[name]
+    headers = {header: request.headers[header] for header in controller.FORWARDED_REQUEST_HEADERS if header in request.headers}
+    data = await request.read() if request.can_read_body else None
+    try:
+        resp = await request.app["sessions"][name].request(
+            request.method, upstream.url + path, params=request.query, headers=headers, data=data,
+            # Only ask for compression when the client did.
+            skip_auto_headers=("Accept-Encoding",),
+        )
+    except (ClientError, asyncio.TimeoutError) as e:
+        return _upstream_error(e)
+    async with resp:
+        response = web.StreamResponse(
+            status=resp.status,
+            headers=[(key, value) for key, value in resp.headers.items() if key.lower() not in controller.HOP_BY_HOP_HEADERS],
+        )
+        await response.prepare(request)
+        async for chunk in resp.content.iter_chunked(controller.PASSTHROUGH_CHUNK_BYTES):
+            await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+async def proxy_persons(request):
+    return await _passthrough(request, "persons", "/persons")
+
+
+async def proxy_locations(request):
+    return await _passthrough(request, "locations", "/locations")
+
+
+async def proxy_connections(request):
+    return await _passthrough(request, "connections", "/connections")
+
+
+async def _fetch_json(app, name, path, params):
+    """``(status, body)`` of a GET, with status None when the upstream cannot be reached."""
+    try:
+        async with app["sessions"][name].get(upstreams.HTTP_UPSTREAMS[name].url + path, params=params, auto_decompress=True) as resp:
+            return resp.status, await resp.json(content_type=None)
+    except (ClientError, asyncio.TimeoutError, ValueError) as e:
+        return None, {"error": str(e) or type(e).__name__}
+
+
+async def person_overview(request):
+    calls = overview.upstream_calls(int(request.match_info["person_id"]))
+    results = await asyncio.gather(*(_fetch_json(request.app, *call) for call in calls.values()))
+    body, status = overview.merge(dict(zip(calls, results)))
+    return web.json_response(body, status=status)
+
+
+async def proximity_query(request):
+    payload = await request.json()
+    grpc_request = location_connection_pb2.LocationRequest(
+        person_id=int(payload["person_id"]),
+        distance=int(payload["meters"]),
+        start=payload.get("start") or "",
+        end=payload.get("end") or "",
+    )
+    try:
+        return web.json_response([{
+            "person_id": r.person_id,
+            "location_id": r.location_id,
+            "creation_time": r.creation_time,
+            "latitude": r.latitude,
+            "longitude": r.longitude,
+            "distance": r.distance
+        } async for r in request.app["stub"].GetNearbyPeople(grpc_request, timeout=upstreams.GRPC_TIMEOUT_SECONDS)])
+    except grpc.aio.AioRpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return web.json_response({"error": e.details()}, status=400)
+        if e.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+            return web.json_response({"error": e.details()}, status=504)
+        if e.code() == grpc.StatusCode.UNAVAILABLE:
+            return web.json_response({"error": e.details()}, status=502)
+        raise
+
+
+async def get_openapi_spec(request):
+    # The aggregator is synchronous and only runs when the docs are opened.
+    spec = await asyncio.get_running_loop().run_in_executor(None, get_aggregated_spec)
+    return web.json_response(spec)
+
+
+async def swagger_ui(request):
+    html, status, headers = controller.swagger_ui()
+    return web.Response(text=html, status=status, content_type="text/html")
+
+
+async def _open_upstreams(app):
+    timeout = ClientTimeout(
+        sock_connect=upstreams.UPSTREAM_CONNECT_TIMEOUT_SECONDS, sock_read=upstreams.UPSTREAM_READ_TIMEOUT_SECONDS,
+    )
+    app["sessions"] = {
+        name: ClientSession(
+            connector=TCPConnector(limit=upstream.pool_size), timeout=timeout, auto_decompress=False,
+        )
+        for name, upstream in upstreams.HTTP_UPSTREAMS.items()
+    }
+    app["channel"] = grpc.aio.insecure_channel(upstreams.CONNECTIONS_GRPC_TARGET, options=upstreams.GRPC_OPTIONS)
+    app["stub"] = location_connection_pb2_grpc.LocationServiceStub(app["channel"])
+
+
+async def _close_upstreams(app):
+    for session in app["sessions"].values():
+        await session.close()
+    await app["channel"].close()
+
+
+def create_app():
+    app = web.Application()
+    app.on_startup.append(_open_upstreams)
+    app.on_cleanup.append(_close_upstreams)
+    for path, handler in (("/persons", proxy_persons), ("/locations", proxy_locations), ("/connections", proxy_connections)):
+        app.router.add_route("GET", path, handler)
+        app.router.add_route("POST", path, handler)
+    app.router.add_get(r"/persons/{person_id:\d+}/overview", person_overview)
+    app.router.add_post("/locations/proximity", proximity_query)
+    app.router.add_get("/openapi.json", get_openapi_spec)
+    app.router.add_get("/swagger-ui", swagger_ui)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host="0.0.0.0", port=GATEWAY_PORT)
@@ -1,13 +1,15 @@
 import grpc
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flasgger import Swagger
 import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 from modules.connections import location_connection_pb2
-from modules.connections import location_connection_pb2_grpc
 from openapi_aggregator import get_aggregated_spec
+import overview, upstreams
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,6 +17,86 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 swagger = Swagger(app)
 
+# Stream upstream bodies to the client byte for byte instead of parsing and
+# re-serializing them; "0" restores the parse-and-jsonify proxy.
+GATEWAY_PASSTHROUGH = os.environ.get("GATEWAY_PASSTHROUGH", "1") == "1"
+PASSTHROUGH_CHUNK_BYTES = int(os.environ.get("GATEWAY_PASSTHROUGH_CHUNK_BYTES", "65536"))
+# Threads issuing the concurrent upstream calls of composite endpoints.
+FANOUT_THREADS = int(os.environ.get("GATEWAY_FANOUT_THREADS", "32"))
+
+# Request headers the upstream needs to answer exactly as it would the client.
+FORWARDED_REQUEST_HEADERS = ("Accept", "Accept-Encoding", "Content-Type", "If-None-Match")
+# Hop-by-hop headers (RFC 7230 section 6.1) describe one connection, not the response.
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade",
+}
+
+
+@app.errorhandler(requests.Timeout)
+def upstream_timeout(e):
+    return jsonify({"error": f"Upstream timed out: {e}"}), 504
+
+
+@app.errorhandler(requests.ConnectionError)
+def upstream_unavailable(e):
+    return jsonify({"error": f"Upstream unavailable: {e}"}), 502
+
+
+def _passthrough(upstream, path):
+    """Relay the request and stream the upstream status, headers and raw body back unchanged.
+
+    The body is not decoded, so a gzip response stays gzip and Content-Length
+    still matches it.
+    """
+    headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+    resp = upstream.request(
+        request.method, path, params=request.args, headers=headers,
+        data=request.get_data() or None, stream=True,
+    )
+
+    def body():
+        try:
+            yield from resp.raw.stream(PASSTHROUGH_CHUNK_BYTES, decode_content=False)
+        finally:
+            resp.close()
+
+    response_headers = [
+        (name, value) for name, value in resp.raw.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS
+    ]
+    return Response(stream_with_context(body()), status=resp.status_code, headers=response_headers)
+
+
+_fanout = ThreadPoolExecutor(FANOUT_THREADS, thread_name_prefix="fanout")
+
+
+def _fetch_json(upstream, path, params):
+    """``(status, body)`` of a GET, with status None when the upstream cannot be reached."""
+    try:
+        resp = upstream.get(path, params=params)
+        return resp.status_code, resp.json()
+    except (requests.RequestException, ValueError) as e:
+        return None, {"error": str(e)}
+
+
+def _conditional_get(upstream, path):
+    """GET a list endpoint, forwarding If-None-Match and passing 304 and ETag through.
+
+    JSON bodies are re-serialized; anything else (e.g. NDJSON) is returned as is.
+    """
+    headers = {name: request.headers[name] for name in ("If-None-Match", "Accept") if name in request.headers}
+    resp = upstream.get(path, params=request.args, headers=headers)
+    if resp.status_code == 304:
+        response = Response(status=304)
+    elif resp.headers.get("Content-Type", "").split(";")[0].strip() == "application/json":
+        response = jsonify(resp.json())
+        response.status_code = resp.status_code
+    else:
+        response = Response(resp.content, status=resp.status_code, content_type=resp.headers.get("Content-Type"))
+    if "ETag" in resp.headers:
+        response.headers["ETag"] = resp.headers["ETag"]
+    return response
+
 @app.route("/persons", methods=["GET", "POST"])
 def proxy_persons():
     """
@@ -26,11 +108,12 @@ def proxy_persons():
       200:
         description: Proxy to persons service
     """
+    if GATEWAY_PASSTHROUGH:
+        return _passthrough(upstreams.persons, "/persons")
     if request.method == "GET":
-        resp = requests.get("http://persons:5000/persons")
-        return jsonify(resp.json()), resp.status_code
+        return _conditional_get(upstreams.persons, "/persons")
     elif request.method == "POST":
-        resp = requests.post("http://persons:5000/persons", json=request.get_json())
+        resp = upstreams.persons.post("/persons", json=request.get_json())
         return jsonify(resp.json()), resp.status_code
 
 @app.route("/locations", methods=["GET", "POST"])
@@ -44,11 +127,12 @@ def proxy_locations():
       200:
         description: Proxy to locations service
     """
+    if GATEWAY_PASSTHROUGH:
+        return _passthrough(upstreams.locations, "/locations")
     if request.method == "GET":
-        resp = requests.get("http://locations:5001/locations")
-        return jsonify(resp.json()), resp.status_code
+        return _conditional_get(upstreams.locations, "/locations")
     elif request.method == "POST":
-        resp = requests.post("http://locations:5001/locations", json=request.get_json())
+        resp = upstreams.locations.post("/locations", json=request.get_json())
         return jsonify(resp.json()), resp.status_code
 
 @app.route("/connections", methods=["GET", "POST"])
@@ -62,13 +146,55 @@ def proxy_connections():
       200:
         description: Proxy to connections service
     """
+    if GATEWAY_PASSTHROUGH:
+        return _passthrough(upstreams.connections, "/connections")
     if request.method == "GET":
-        resp = requests.get("http://connections:5003/connections")
-        return jsonify(resp.json()), resp.status_code
+        return _conditional_get(upstreams.connections, "/connections")
     elif request.method == "POST":
-        resp = requests.post("http://connections:5003/connections", json=request.get_json())
+        resp = upstreams.connections.post("/connections", json=request.get_json())
         return jsonify(resp.json()), resp.status_code
 
+@app.route("/persons/<int:person_id>/overview", methods=["GET"])
+def person_overview(person_id):
+    """
+    Person overview
+    ---
+    tags:
+      - api-gateway
+    parameters:
+      - in: path
+        name: person_id
+        type: integer
+        required: true
+    responses:
+      200:
+        description: The person with their newest locations and connections of the last OVERVIEW_DAYS days (at most OVERVIEW_LIMIT of each, newest first), fetched concurrently
+        schema:
+          type: object
+          properties:
+            person:
+              type: object
+            locations:
+              type: array
+              items:
+                type: object
+            connections:
+              type: array
+              items:
+                type: object
+      404:
+        description: No person with this id
+      502:
+        description: An upstream service failed or could not be reached
+    """
+    calls = overview.upstream_calls(person_id)
+    futures = {
+        part: _fanout.submit(_fetch_json, upstreams.HTTP_UPSTREAMS[name], path, params)
+        for part, (name, path, params) in calls.items()
+    }
+    body, status = overview.merge({part: future.result() for part, future in futures.items()})
+    return jsonify(body), status
+
 @app.route("/locations/proximity", methods=["POST"])
 def proximity_query():
     """
@@ -87,6 +213,13 @@ def proximity_query():
               type: integer
             meters:
               type: integer
+            start:
+              type: string
+              format: date-time
+              description: Optional start of the time window (default last 24 hours)
+            end:
+              type: string
+              format: date-time
     responses:
       200:
         description: List of nearby persons
@@ -96,19 +229,29 @@ def proximity_query():
             type: object
     """
     payload = request.get_json()
-    channel = grpc.insecure_channel("connections:50051")
-    stub = location_connection_pb2_grpc.LocationServiceStub(channel)
     grpc_request = location_connection_pb2.LocationRequest(
-        person_id=payload["person_id"],
-        distance=payload["meters"]
+        person_id=int(payload["person_id"]),
+        distance=int(payload["meters"]),
+        start=payload.get("start") or "",
+        end=payload.get("end") or "",
     )
-    response = stub.CheckNearby(grpc_request)
-    return jsonify([{
-        "person_id": r.person_id,
-        "latitude": r.latitude,
-        "longitude": r.longitude,
-        "distance": r.distance
-    } for r in response.nearby_persons])
+    try:
+        return jsonify([{
+            "person_id": r.person_id,
+            "location_id": r.location_id,
+            "creation_time": r.creation_time,
+            "latitude": r.latitude,
+            "longitude": r.longitude,
+            "distance": r.distance
+        } for r in upstreams.connections_grpc.stub.GetNearbyPeople(grpc_request, timeout=upstreams.GRPC_TIMEOUT_SECONDS)])
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": e.details()}), 400
+        if e.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+            return jsonify({"error": e.details()}), 504
+        if e.code() == grpc.StatusCode.UNAVAILABLE:
+            return jsonify({"error": e.details()}), 502
+        raise
 
 
 @app.route("/openapi.json", methods=["GET"])
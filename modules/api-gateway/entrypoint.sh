@@ -1,4 +1,8 @@
 #!/bin/bash
 set -e
 export PYTHONPATH=/app:${PYTHONPATH}
+# GATEWAY_MODE=asyncio serves the gateway from one event loop (async_gateway.py).
+if [ "${GATEWAY_MODE}" = "asyncio" ]; then
+    exec python -u /app/async_gateway.py
+fi
 exec python -u /app/controller.py "$@"
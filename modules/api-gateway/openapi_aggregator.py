@@ -5,27 +5,28 @@ Fetches and aggregates OpenAPI/Swagger specifications from downstream services
 and provides a combined view accessible from the API Gateway.
 """
 
-import requests
 from typing import Dict, List, Any, Optional
 import logging
 from functools import lru_cache
 import time
 
+import upstreams
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # Downstream service configurations
 DOWNSTREAM_SERVICES = {
     "persons": {
-        "url": "http://persons:5000",
+        "url": upstreams.persons.url,
         "description": "Person management service"
     },
     "locations": {
-        "url": "http://locations:5001",
+        "url": upstreams.locations.url,
         "description": "Location tracking service"
     },
     "connections": {
-        "url": "http://connections:5003",
+        "url": upstreams.connections.url,
         "description": "Connection and proximity service"
     }
 }
@@ -49,7 +50,7 @@ def fetch_service_spec(service_name: str, service_url: str, timeout: int = 5) ->
     """
     try:
         spec_url = f"{service_url}/apispec_1.json"  # Flasgger default endpoint
-        response = requests.get(spec_url, timeout=timeout)
+        response = upstreams.HTTP_UPSTREAMS[service_name].session.get(spec_url, timeout=timeout)
         response.raise_for_status()
         return response.json()
     except Exception as e:
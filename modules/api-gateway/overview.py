@@ -0,0 +1,43 @@
+"""
+GET /persons/<id>/overview: a person with their recent locations and connections.
+
+Locations and connections are the newest OVERVIEW_LIMIT of the last
+OVERVIEW_DAYS, listed newest first.
+
+The three upstream calls do not depend on each other, so both gateway modes
+issue them concurrently and the endpoint takes as long as the slowest one.
+This module holds what the modes share: which calls to make and how their
+answers are merged.
+"""
+import os
+from datetime import datetime, timedelta
+
+# Locations and connections of the last OVERVIEW_DAYS are included, at most OVERVIEW_LIMIT of each.
+OVERVIEW_DAYS = float(os.environ.get("OVERVIEW_DAYS", "7"))
+OVERVIEW_LIMIT = int(os.environ.get("OVERVIEW_LIMIT", "100"))
+
+
+def upstream_calls(person_id, now=None):
+    """``{part: (upstream name, path, params)}`` for the parts of an overview."""
+    since = ((now or datetime.utcnow()) - timedelta(days=OVERVIEW_DAYS)).isoformat()
+    limit = str(OVERVIEW_LIMIT)
+    return {
+        "person": ("persons", f"/persons/{person_id}", {}),
+        "locations": ("locations", "/locations", {"person_id": str(person_id), "start": since, "order": "desc", "limit": limit}),
+        "connections": (
+            "connections", "/connections", {"person_id": str(person_id), "since": since, "order": "desc", "limit": limit},
+        ),
+    }
+
+
+def merge(results):
+    """Combine ``{part: (status, body)}`` into the overview's ``(body, status)``.
+
+    A status of None means the upstream could not be reached.
+    """
+    if results["person"][0] == 404:
+        return {"error": "Person not found"}, 404
+    failed = {part: body for part, (status, body) in results.items() if status != 200}
+    if failed:
+        return {"error": "Upstream request failed", "upstreams": failed}, 502
+    return {part: body for part, (_, body) in results.items()}, 200
@@ -0,0 +1,97 @@
+"""
+Upstream services of the gateway, each behind one long-lived client.
+
+Every HTTP upstream has its own requests.Session whose connection pool keeps
+connections to the service alive between proxied calls, and the gRPC
+upstream keeps one channel and stub for the life of the process, so no call
+pays for a TCP (or HTTP/2) handshake once the pools are warm. Hosts, pool
+sizes and timeouts come from the environment; ``<NAME>_URL`` and
+``<NAME>_POOL_SIZE`` configure one HTTP upstream, e.g. PERSONS_URL.
+"""
+import os
+import threading
+
+import grpc
+import requests
+from requests.adapters import HTTPAdapter
+
+from modules.connections import location_connection_pb2_grpc
+
+# Keep-alive connections per HTTP upstream; size it to the gateway's request threads.
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "20"))
+UPSTREAM_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT_SECONDS", "2"))
+UPSTREAM_READ_TIMEOUT_SECONDS = float(os.environ.get("UPSTREAM_READ_TIMEOUT_SECONDS", "10"))
+CONNECTIONS_GRPC_TARGET = os.environ.get("CONNECTIONS_GRPC_TARGET", "connections:50051")
+# Deadline of one gRPC call, including a streamed response.
+GRPC_TIMEOUT_SECONDS = float(os.environ.get("GRPC_TIMEOUT_SECONDS", "30"))
+
+GRPC_OPTIONS = [
+    # Detect a dead connection during long streams instead of waiting for TCP.
+    ("grpc.keepalive_time_ms", 60000),
+    ("grpc.keepalive_timeout_ms", 10000),
+]
+
+
+class HttpUpstream:
+    def __init__(self, name, url, pool_size):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = (UPSTREAM_CONNECT_TIMEOUT_SECONDS, UPSTREAM_READ_TIMEOUT_SECONDS)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, self.url + path, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+
+def _http_upstream(name, default_url):
+    prefix = name.upper()
+    return HttpUpstream(
+        name,
+        os.environ.get(f"{prefix}_URL", default_url),
+        int(os.environ.get(f"{prefix}_POOL_SIZE", UPSTREAM_POOL_SIZE)),
+    )
+
+
+class GrpcUpstream:
+    """A channel and stub opened on first use and shared by every request thread."""
+
+    def __init__(self, target, stub_class):
+        self.target = target
+        self.stub_class = stub_class
+        self._stub = None
+        self._channel = None
+        self._lock = threading.Lock()
+
+    @property
+    def stub(self):
+        if self._stub is None:
+            with self._lock:
+                if self._stub is None:
+                    self._channel = grpc.insecure_channel(self.target, options=GRPC_OPTIONS)
+                    self._stub = self.stub_class(self._channel)
+        return self._stub
+
+    def close(self):
+        with self._lock:
+            if self._channel is not None:
+                self._channel.close()
+            self._channel = self._stub = None
+
+
+persons = _http_upstream("persons", "http://persons:5000")
+locations = _http_upstream("locations", "http://locations:5001")
+connections = _http_upstream("connections", "http://connections:5003")
+HTTP_UPSTREAMS = {upstream.name: upstream for upstream in (persons, locations, connections)}
+
+connections_grpc = GrpcUpstream(CONNECTIONS_GRPC_TARGET, location_connection_pb2_grpc.LocationServiceStub)
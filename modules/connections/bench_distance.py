@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of the vectorised distance engine against a pure-Python loop.
+
+Usage:
+    python bench_distance.py [--sizes 1e4,1e5,1e6,1e7] [--python-max 1e6] [--queries 64]
+
+For every size it reports the time to compute the distance from one point to
+all N points (haversine and equirectangular), the same with a plain Python
+loop (skipped above --python-max points, where it takes minutes), and the
+time for a many-query batch through ``within_many``.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+import distance
+
+
+def python_haversine(lat1, lon1, lats, lons):
+    phi1 = math.radians(lat1)
+    cos_phi1 = math.cos(phi1)
+    lam1 = math.radians(lon1)
+    out = []
+    for lat2, lon2 in zip(lats, lons):
+        phi2 = math.radians(lat2)
+        a = math.sin((phi2 - phi1) / 2) ** 2 + cos_phi1 * math.cos(phi2) * math.sin((math.radians(lon2) - lam1) / 2) ** 2
+        out.append(2 * distance.EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a))))
+    return out
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1e4,1e5,1e6,1e7")
+    parser.add_argument("--python-max", type=float, default=1e6)
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--meters", type=float, default=500.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'points':>10} {'haversine':>11} {'equirect':>11} {'python':>11} {'speedup':>8} {'batch':>11}")
+    for n in (int(float(size)) for size in args.sizes.split(",")):
+        lats = rng.uniform(24.6, 24.9, n)
+        lons = rng.uniform(46.6, 46.9, n)
+        columns = distance.LocationColumns(np.arange(n), rng.integers(0, 10000, n), lats, lons)
+        repeat = 5 if n <= 1_000_000 else 2
+
+        t_hav = best_of(lambda: columns.distances(24.75, 46.75), repeat)
+        t_eq = best_of(lambda: columns.distances(24.75, 46.75, "equirectangular"), repeat)
+        if n <= args.python_max:
+            lat_list, lon_list = lats.tolist(), lons.tolist()
+            t_py = best_of(lambda: python_haversine(24.75, 46.75, lat_list, lon_list), 1)
+            python, speedup = f"{t_py * 1e3:9.1f}ms", f"{t_py / t_hav:7.0f}x"
+        else:
+            python, speedup = f"{'skipped':>11}", f"{'-':>8}"
+
+        q_lats = rng.uniform(24.6, 24.9, args.queries)
+        q_lons = rng.uniform(46.6, 46.9, args.queries)
+        t_batch = best_of(lambda: columns.within_many(q_lats, q_lons, args.meters), 1)
+
+        print(f"{n:>10} {t_hav * 1e3:9.2f}ms {t_eq * 1e3:9.2f}ms {python} {speedup} {t_batch * 1e3:9.1f}ms")
+    print(f"batch = {args.queries} queries x all points, {args.meters:g} m radius")
+
+
+if __name__ == "__main__":
+    main()
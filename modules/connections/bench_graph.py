@@ -0,0 +1,90 @@
+"""
+Benchmark of the in-memory contact graph.
+
+Usage:
+    python bench_graph.py [--persons 1e6] [--edges 1e7] [--days 30] [--queries 100]
+
+Builds a random contact graph (``--edges`` undirected contacts among
+``--persons`` people spread over ``--days``), then reports the build time,
+the memory of the CSR arrays, the peak RSS of the process and the median
+and p99 latency of BFS traversals at depth 1-3, over all time and limited to
+the last two days. It also times folding a batch of new edges into the delta
+and the rebuild that compacts it.
+"""
+import argparse
+import resource
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import graph
+
+
+def percentiles(samples):
+    samples = np.array(samples) * 1e3
+    return f"p50 {np.percentile(samples, 50):8.2f}ms  p99 {np.percentile(samples, 99):8.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--persons", type=float, default=1e6)
+    parser.add_argument("--edges", type=float, default=1e7)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--delta", type=int, default=100000)
+    args = parser.parse_args()
+
+    persons, edges = int(args.persons), int(args.edges)
+    rng = np.random.default_rng(42)
+    end = datetime(2025, 9, 1)
+    end_seconds = graph._seconds(end)
+    sources = rng.integers(1, persons + 1, edges)
+    targets = rng.integers(1, persons + 1, edges)
+    seconds = rng.integers(end_seconds - args.days * 86400, end_seconds, edges).astype(np.uint32)
+
+    started = time.perf_counter()
+    snapshot = graph.Snapshot.build(sources, targets, seconds, edges)
+    built = time.perf_counter() - started
+    del sources, targets, seconds
+    print(f"{len(snapshot.nodes)} persons, {snapshot.edges} edges")
+    print(f"build {built:.2f}s, CSR arrays {snapshot.nbytes / 2**20:.0f} MiB, "
+          f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10:.0f} MiB")
+
+    starts = rng.integers(1, persons + 1, args.queries).tolist()
+    since = end - timedelta(days=2)
+    for depth in (1, 2, 3):
+        for label, window in (("all time", None), ("2 days", since)):
+            samples, reached = [], []
+            for person_id in starts:
+                t = time.perf_counter()
+                reached.append(len(snapshot.traverse(person_id, depth, since=window)))
+                samples.append(time.perf_counter() - t)
+            print(f"depth {depth} {label:>8}: {percentiles(samples)}  median reached {int(np.median(reached))}")
+
+    # Incremental refresh: new rows go to the delta, then get compacted.
+    new = [(int(a), int(b), int(s)) for a, b, s in zip(
+        rng.integers(1, persons + 1, args.delta), rng.integers(1, persons + 1, args.delta),
+        rng.integers(end_seconds - 3600, end_seconds, args.delta),
+    )]
+    t = time.perf_counter()
+    delta = {}
+    for a, b, s in new:
+        delta.setdefault(a, []).append((b, s))
+        delta.setdefault(b, []).append((a, s))
+    merged = graph.Snapshot(snapshot.nodes, snapshot.offsets, snapshot.neighbours, snapshot.edge_times, delta, edges + args.delta)
+    t_delta = time.perf_counter() - t
+    samples = []
+    for person_id in starts:
+        t = time.perf_counter()
+        merged.traverse(person_id, 2)
+        samples.append(time.perf_counter() - t)
+    print(f"delta of {args.delta} edges: fold {t_delta * 1e3:.0f}ms, depth 2 {percentiles(samples)}")
+    t = time.perf_counter()
+    graph.Snapshot.build(*merged.edge_arrays(), merged.last_id)
+    print(f"compacting rebuild {time.perf_counter() - t:.2f}s, "
+          f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
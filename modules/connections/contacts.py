@@ -0,0 +1,269 @@
+"""
+Batch contact detection.
+
+Reads ``location`` rows for a time range and materialises every pair of
+different persons whose locations were within ``--meters`` of each other at
+most ``--minutes`` apart as a row in ``connections``::
+
+    person_id / location_id                  one side of the contact
+    contact_person_id / contact_location_id  the other side
+    creation_time                            time of the later location
+
+Pairs are stored once, with ``location_id < contact_location_id``, and
+upserted with ON CONFLICT DO NOTHING, so re-running a range is safe.
+
+The join is a sort-and-grid join: pings are keyed by (time slice, grid row,
+grid column) with slices ``--minutes`` long and cells at least ``--meters``
+wide, sorted by key, and each bucket is compared only with itself and its
+13 forward neighbours in that 3x3x2 neighbourhood. All candidate pairs are
+expanded and filtered with NumPy. The range is split into ``--slice-hours``
+chunks processed by a pool of ``--workers`` processes.
+
+Usage:
+    python contacts.py --start 2025-08-01 --end 2025-09-01 [--meters 50] [--minutes 10]
+                       [--slice-hours 6] [--workers 4]
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import select
+
+import distance
+
+logger = logging.getLogger(__name__)
+
+# Meters per degree of latitude on the sphere distance.haversine() measures on.
+METERS_PER_DEGREE = 2 * math.pi * distance.EARTH_RADIUS_METERS / 360.0
+# Candidate pairs expanded in memory at once.
+MAX_CANDIDATE_PAIRS = int(os.environ.get("CONTACTS_MAX_CANDIDATE_PAIRS", "4000000"))
+# Rows per upsert statement.
+UPSERT_CHUNK_ROWS = int(os.environ.get("CONTACTS_UPSERT_CHUNK_ROWS", "5000"))
+
+# Forward half of the (slice, row, column) neighbourhood; with the bucket
+# itself this visits every neighbouring bucket pair exactly once.
+_FORWARD_OFFSETS = [(0, 0, 1), (0, 1, -1), (0, 1, 0), (0, 1, 1)] + [
+    (1, dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+]
+
+
+def _expand(starts, counts, ia, ib):
+    """All (a, b) point index pairs between buckets ``ia[k]`` and ``ib[k]``."""
+    ca = counts[ia]
+    cb = counts[ib]
+    n = ca * cb
+    pair = np.repeat(np.arange(len(ia)), n)
+    offset = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    return starts[ia][pair] + offset // cb[pair], starts[ib][pair] + offset % cb[pair]
+
+
+def _bucket_pair_chunks(starts, counts, ia, ib):
+    """Yield point index pairs for bucket pairs, at most MAX_CANDIDATE_PAIRS at a time."""
+    sizes = counts[ia] * counts[ib]
+    big = sizes > MAX_CANDIDATE_PAIRS
+    # Oversized bucket pairs (very dense places) are split along the first bucket.
+    for a, b in zip(ia[big], ib[big]):
+        step = max(1, MAX_CANDIDATE_PAIRS // counts[b])
+        for lo in range(starts[a], starts[a] + counts[a], step):
+            hi = min(lo + step, starts[a] + counts[a])
+            pa = np.repeat(np.arange(lo, hi), counts[b])
+            pb = np.tile(np.arange(starts[b], starts[b] + counts[b]), hi - lo)
+            yield pa, pb
+    ia, ib, sizes = ia[~big], ib[~big], sizes[~big]
+    bounds = np.searchsorted(np.cumsum(sizes), np.arange(MAX_CANDIDATE_PAIRS, sizes.sum() + MAX_CANDIDATE_PAIRS, MAX_CANDIDATE_PAIRS), side="right")
+    lo = 0
+    for hi in bounds:
+        if hi > lo:
+            yield _expand(starts, counts, ia[lo:hi], ib[lo:hi])
+        lo = hi
+
+
+def find_contacts(person_ids, latitudes, longitudes, seconds, meters, window_seconds):
+    """Return index arrays ``(a, b)`` of every contact pair among the pings.
+
+    A contact is two pings of different persons within `meters` (haversine)
+    and at most `window_seconds` apart. Each unordered pair appears once.
+    """
+    person_ids = np.asarray(person_ids, dtype=np.int64)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    seconds = np.asarray(seconds, dtype=np.float64)
+    if len(person_ids) < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    # Cells are `meters` tall and at least `meters` wide at the most pole-ward
+    # latitude present, so any contact lies in neighbouring cells.
+    cell_lat = meters / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(float(np.abs(latitudes).max()) + cell_lat, 89.9)))
+    cell_lon = meters / (METERS_PER_DEGREE * cos_lat)
+    tslice = np.floor(seconds / window_seconds).astype(np.int64)
+    row = np.floor((latitudes + 90.0) / cell_lat).astype(np.int64)
+    col = np.floor((longitudes + 180.0) / cell_lon).astype(np.int64)
+    # Pad each dimension by one so neighbour offsets never wrap into another row.
+    tslice -= tslice.min()
+    row -= row.min() - 1
+    col -= col.min() - 1
+    n_cols = int(col.max()) + 2
+    n_rows = int(row.max()) + 2
+    key = (tslice * n_rows + row) * n_cols + col
+
+    order = np.argsort(key, kind="stable")
+    keys, starts, counts = np.unique(key[order], return_index=True, return_counts=True)
+
+    a_parts, b_parts = [], []
+
+    def collect(pa, pb):
+        pa, pb = order[pa], order[pb]
+        keep = person_ids[pa] != person_ids[pb]
+        keep &= np.abs(seconds[pa] - seconds[pb]) <= window_seconds
+        pa, pb = pa[keep], pb[keep]
+        near = distance.haversine(latitudes[pa], longitudes[pa], latitudes[pb], longitudes[pb]) <= meters
+        a_parts.append(pa[near])
+        b_parts.append(pb[near])
+
+    # Pairs inside one bucket.
+    inner = np.flatnonzero(counts > 1)
+    for pa, pb in _bucket_pair_chunks(starts, counts, inner, inner):
+        upper = pa < pb
+        collect(pa[upper], pb[upper])
+    # Pairs between a bucket and each forward neighbour that exists.
+    for dt, dy, dx in _FORWARD_OFFSETS:
+        target = keys + (dt * n_rows + dy) * n_cols + dx
+        ib = np.searchsorted(keys, target)
+        ib_clipped = np.minimum(ib, len(keys) - 1)
+        found = keys[ib_clipped] == target
+        for pa, pb in _bucket_pair_chunks(starts, counts, np.flatnonzero(found), ib_clipped[found]):
+            collect(pa, pb)
+
+    if not a_parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(a_parts), np.concatenate(b_parts)
+
+
+def _load_pings(db, start, end):
+    # Imported here, like the rest of the database layer, so the join itself
+    # can be used without a database.
+    import models
+
+    Location = models.Location
+    statement = (
+        select(Location.id, Location.person_id, Location.latitude, Location.longitude, Location.creation_time)
+        .where(Location.creation_time >= start, Location.creation_time < end)
+        .execution_options(stream_results=True, yield_per=50000)
+    )
+    ids, person_ids, latitudes, longitudes, times = [], [], [], [], []
+    for row in db.execute(statement):
+        ids.append(row.id)
+        person_ids.append(row.person_id)
+        latitudes.append(row.latitude)
+        longitudes.append(row.longitude)
+        times.append(row.creation_time)
+    seconds = np.array(times, dtype="datetime64[us]").astype(np.int64) / 1e6
+    return np.array(ids, dtype=np.int64), np.array(person_ids, dtype=np.int64), latitudes, longitudes, seconds
+
+
+def contact_rows(ids, person_ids, seconds, a, b, min_seconds=None):
+    """Turn contact index pairs into ``connections`` rows, smaller location id first."""
+    swap = ids[a] > ids[b]
+    first = np.where(swap, b, a)
+    second = np.where(swap, a, b)
+    contact_seconds = np.maximum(seconds[a], seconds[b])
+    if min_seconds is not None:
+        keep = contact_seconds >= min_seconds
+        first, second, contact_seconds = first[keep], second[keep], contact_seconds[keep]
+    return [
+        {
+            "person_id": int(person_ids[i]),
+            "location_id": int(ids[i]),
+            "contact_person_id": int(person_ids[j]),
+            "contact_location_id": int(ids[j]),
+            "creation_time": datetime.fromtimestamp(float(s), timezone.utc).replace(tzinfo=None),
+        }
+        for i, j, s in zip(first, second, contact_seconds)
+    ]
+
+
+def process_slice(start, end, meters, minutes):
+    """Detect and upsert the contacts whose later ping falls in ``[start, end)``."""
+    import service
+    from database import SessionLocal
+
+    window = timedelta(minutes=minutes)
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        # Read one window earlier so contacts across the slice boundary are seen.
+        ids, person_ids, latitudes, longitudes, seconds = _load_pings(db, start - window, end)
+        a, b = find_contacts(person_ids, latitudes, longitudes, seconds, meters, window.total_seconds())
+        min_seconds = start.replace(tzinfo=timezone.utc).timestamp()
+        rows = contact_rows(ids, person_ids, seconds, a, b, min_seconds)
+        inserted = 0
+        for chunk in range(0, len(rows), UPSERT_CHUNK_ROWS):
+            inserted += service.upsert_connections(db, rows[chunk:chunk + UPSERT_CHUNK_ROWS])
+        logger.info(
+            "%s - %s: %d pings, %d contacts, %d new in %.1fs",
+            start, end, len(ids), len(rows), inserted, time.perf_counter() - started,
+        )
+        return len(ids), len(rows), inserted
+    finally:
+        db.close()
+
+
+def _init_worker():
+    # Connections inherited from the parent process must not be shared.
+    from database import engine
+    engine.dispose(close=False)
+
+
+def _process_slice_args(args):
+    return process_slice(*args)
+
+
+def _parse_time(value):
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", required=True, type=_parse_time, help="ISO 8601 start of the range (UTC)")
+    parser.add_argument("--end", required=True, type=_parse_time, help="ISO 8601 end of the range (UTC)")
+    parser.add_argument("--meters", type=float, default=50.0)
+    parser.add_argument("--minutes", type=float, default=10.0)
+    parser.add_argument("--slice-hours", type=float, default=6.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+    step = timedelta(hours=args.slice_hours)
+    slices = []
+    lo = args.start
+    while lo < args.end:
+        hi = min(lo + step, args.end)
+        slices.append((lo, hi, args.meters, args.minutes))
+        lo = hi
+
+    started = time.perf_counter()
+    if args.workers > 1 and len(slices) > 1:
+        with multiprocessing.Pool(min(args.workers, len(slices)), initializer=_init_worker) as pool:
+            results = pool.map(_process_slice_args, slices, chunksize=1)
+    else:
+        results = [_process_slice_args(s) for s in slices]
+    pings, contacts, inserted = (sum(r[i] for r in results) for i in range(3))
+    logger.info(
+        "Done: %d slices, %d pings, %d contacts, %d new in %.1fs",
+        len(slices), pings, contacts, inserted, time.perf_counter() - started,
+    )
+
+
+if __name__ == "__main__":
+    main()
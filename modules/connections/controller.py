@@ -1,15 +1,103 @@
+import functools
+import json
+import logging
+import os
+from datetime import datetime, timezone
 from flask import Flask
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, make_response, stream_with_context
+from pydantic import ValidationError
 from database import get_db
 from models import Connection
 from database import Base, engine
-import service, schema
+import service, schema, grpc_server, migrate, persons_client
 from flasgger import Swagger
+logger = logging.getLogger(__name__)
 app = Flask(__name__)
 swagger = Swagger(app)
 Base.metadata.create_all(bind=engine)
+migrate.upgrade(engine)
 connection_blueprint = Blueprint("connection", __name__)
 
+PAGE_DEFAULT_LIMIT = int(os.environ.get("PAGE_DEFAULT_LIMIT", "100"))
+PAGE_MAX_LIMIT = int(os.environ.get("PAGE_MAX_LIMIT", "1000"))
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonlines", "application/jsonl")
+STREAM_LINES_PER_CHUNK = 500
+BATCH_MAX_ROWS = int(os.environ.get("CONNECTION_BATCH_MAX_ROWS", "10000"))
+GRAPH_MAX_DEPTH = int(os.environ.get("GRAPH_MAX_DEPTH", "3"))
+
+
+def _parse_time(value):
+        """Parse an ISO 8601 query parameter into a naive UTC datetime."""
+        if value is None:
+                return None
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+
+
+def _wants_ndjson():
+        if request.args.get("format") == "ndjson":
+                return True
+        return request.accept_mimetypes.best in NDJSON_MIMETYPES
+
+
+def _ndjson(db, rows, serialize):
+        try:
+                lines = []
+                for row in rows:
+                        lines.append(json.dumps(serialize(row)))
+                        if len(lines) >= STREAM_LINES_PER_CHUNK:
+                                yield "\n".join(lines) + "\n"
+                                lines = []
+                if lines:
+                        yield "\n".join(lines) + "\n"
+        finally:
+                db.close()
+
+
+def _serialize(c):
+        return {
+                "id": c.id, "person_id": c.person_id, "location_id": c.location_id, "creation_time": c.creation_time.isoformat(),
+                "contact_person_id": c.contact_person_id, "contact_location_id": c.contact_location_id,
+        }
+
+def _conditional(view):
+        """Answer 304 Not Modified when If-None-Match holds the current table version."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+                # Expanded person details can change without this table changing.
+                if request.args.get("expand"):
+                        return view(*args, **kwargs)
+                db = next(get_db())
+                try:
+                        etag = f"{service.get_list_version(db)}-{'ndjson' if _wants_ndjson() else 'json'}"
+                finally:
+                        db.close()
+                if request.if_none_match.contains(etag):
+                        response = Response(status=304)
+                        response.set_etag(etag)
+                        return response
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                        response.set_etag(etag)
+                return response
+        return wrapper
+
+
+def _serialize_all(connections):
+        """Serialize a listing, adding person details when ?expand=person is given."""
+        data = [_serialize(c) for c in connections]
+        if request.args.get("expand") != "person":
+                return data
+        ids = {d["person_id"] for d in data} | {d["contact_person_id"] for d in data if d["contact_person_id"] is not None}
+        persons = persons_client.get_persons(ids)
+        for d in data:
+                d["person"] = persons.get(d["person_id"])
+                if d["contact_person_id"] is not None:
+                        d["contact_person"] = persons.get(d["contact_person_id"])
+        return data
+
 @connection_blueprint.route("/connections", methods=["POST"])
 def create_connection():
         """
@@ -30,7 +118,7 @@ def create_connection():
                             type: integer
         responses:
             201:
-                description: Created connection
+                description: Created connection, or the stored one when this sighting or contact already exists
                 schema:
                     type: object
                     properties:
@@ -38,29 +126,256 @@ def create_connection():
                             type: integer
         """
         db = next(get_db())
-    data = request.json
-    new_conn = schema.ConnectionCreate(**data)
-    result = service.create_connection(db, new_conn)
-    return jsonify({"id": result.id})
+        data = request.json
+        new_conn = schema.ConnectionCreate(**data)
+        result = service.create_connection(db, new_conn)
+        return jsonify({"id": result.id})
+
+@connection_blueprint.route("/connections/batch", methods=["POST"])
+def create_connections_batch():
+        """
+        Upsert Connections In Bulk
+        ---
+        tags:
+            - connections
+        consumes:
+            - application/json
+            - application/x-ndjson
+        parameters:
+            - in: body
+                name: body
+                required: true
+                description: JSON array of connections, or one connection object per line with Content-Type application/x-ndjson. Rows already stored are skipped, so a batch can be replayed safely.
+                schema:
+                    type: array
+                    items:
+                        type: object
+                        properties:
+                            person_id:
+                                type: integer
+                            location_id:
+                                type: integer
+                            creation_time:
+                                type: string
+                                format: date-time
+                            contact_person_id:
+                                type: integer
+                            contact_location_id:
+                                type: integer
+        responses:
+            200:
+                description: Number of rows received and newly inserted
+                schema:
+                    type: object
+                    properties:
+                        received:
+                            type: integer
+                        inserted:
+                            type: integer
+            400:
+                description: Malformed body or invalid connection
+            413:
+                description: Too many connections in one request
+        """
+        try:
+                if request.mimetype in NDJSON_MIMETYPES:
+                        items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+                else:
+                        items = request.get_json()
+        except ValueError as e:
+                return jsonify({"error": f"Malformed body: {e}"}), 400
+        if not isinstance(items, list):
+                return jsonify({"error": "Expected a JSON array or NDJSON body"}), 400
+        if len(items) > BATCH_MAX_ROWS:
+                return jsonify({"error": f"At most {BATCH_MAX_ROWS} connections per batch"}), 413
+        rows = []
+        for index, item in enumerate(items):
+                try:
+                        rows.append(schema.ConnectionCreate(**item).dict())
+                except (TypeError, ValidationError) as e:
+                        return jsonify({"error": f"Invalid connection at index {index}: {e}"}), 400
+        db = next(get_db())
+        inserted = service.upsert_connections(db, rows)
+        return jsonify({"received": len(rows), "inserted": inserted})
 
 @connection_blueprint.route("/connections", methods=["GET"])
+@_conditional
 def get_connections():
         """
         List Connections
         ---
         tags:
             - connections
+        parameters:
+            - in: query
+                name: after_id
+                type: integer
+                required: false
+                description: Return only connections with a larger id (keyset pagination)
+            - in: query
+                name: limit
+                type: integer
+                required: false
+                description: Page size; enables pagination when given
+            - in: query
+                name: format
+                type: string
+                enum: [json, ndjson]
+                required: false
+                description: ndjson streams every row, one JSON object per line
+            - in: query
+                name: person_id
+                type: integer
+                required: false
+                description: Return connections with this person on either side, in time order, instead
+            - in: query
+                name: since
+                type: string
+                format: date-time
+                required: false
+                description: With person_id, only connections at or after this time
+            - in: query
+                name: until
+                type: string
+                format: date-time
+                required: false
+                description: With person_id, only connections before this time
+            - in: query
+                name: order
+                type: string
+                enum: [asc, desc]
+                required: false
+                description: With person_id, oldest first (asc, the default) or newest first (desc); limit keeps the first rows in this order
+            - in: query
+                name: expand
+                type: string
+                enum: [person]
+                required: false
+                description: Add person (and contact_person) details, fetched in one batched lookup; not applied to ndjson
         responses:
             200:
-                description: List of connections
+                description: List of connections. Paginated responses carry X-Next-After-Id while more rows remain.
                 schema:
                     type: array
                     items:
                         type: object
+            502:
+                description: Person details requested but the persons service could not be reached
+        """
+        db = next(get_db())
+        after_id = request.args.get("after_id", type=int)
+        limit = request.args.get("limit", type=int)
+        person_id = request.args.get("person_id", type=int)
+        if person_id is not None:
+                try:
+                        since = _parse_time(request.args.get("since"))
+                        until = _parse_time(request.args.get("until"))
+                except ValueError:
+                        return jsonify({"error": "since and until must be ISO 8601 timestamps"}), 400
+                order = request.args.get("order", "asc")
+                if order not in ("asc", "desc"):
+                        return jsonify({"error": "order must be asc or desc"}), 400
+                if limit is not None:
+                        limit = max(1, min(limit, PAGE_MAX_LIMIT))
+                connections = service.get_person_connections(db, person_id, since, until, limit, newest_first=order == "desc")
+        elif _wants_ndjson():
+                rows = service.iter_connections(db, after_id or 0)
+                return Response(stream_with_context(_ndjson(db, rows, _serialize)), mimetype="application/x-ndjson")
+        elif after_id is None and limit is None:
+                connections = service.get_all_connections(db)
+        else:
+                limit = max(1, min(limit or PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT))
+                connections = service.get_connections_page(db, after_id or 0, limit)
+        try:
+                response = jsonify(_serialize_all(connections))
+        except persons_client.PersonsUnavailable as e:
+                # The cause names internal hosts, so it is only logged.
+                logger.warning("Persons service unavailable: %s", e)
+                return jsonify({"error": "Persons service unavailable"}), 502
+        if person_id is None and len(connections) == limit:
+                response.headers["X-Next-After-Id"] = str(connections[-1].id)
+        return response
+
+@connection_blueprint.route("/connections/graph", methods=["GET"])
+def get_contact_graph():
+        """
+        N-degree contacts of a person
+        ---
+        tags:
+            - connections
+        parameters:
+            - in: query
+                name: person_id
+                type: integer
+                required: true
+            - in: query
+                name: depth
+                type: integer
+                required: false
+                description: Maximum number of contact hops (default 2, capped by GRAPH_MAX_DEPTH)
+            - in: query
+                name: since
+                type: string
+                required: false
+                description: ISO 8601 time; only contacts at or after it are followed
+            - in: query
+                name: until
+                type: string
+                required: false
+                description: ISO 8601 time; only contacts before it are followed
+        responses:
+            200:
+                description: Persons reachable through detected contacts, nearest first
+                schema:
+                    type: object
+                    properties:
+                        person_id:
+                            type: integer
+                        contacts:
+                            type: array
+                            items:
+                                type: object
+                                properties:
+                                    person_id:
+                                        type: integer
+                                    depth:
+                                        type: integer
+            400:
+                description: Missing person_id, bad depth or bad time
+        """
+        person_id = request.args.get("person_id", type=int)
+        depth = request.args.get("depth", 2, type=int)
+        if person_id is None:
+                return jsonify({"error": "person_id is required"}), 400
+        if not 1 <= depth <= GRAPH_MAX_DEPTH:
+                return jsonify({"error": f"depth must be between 1 and {GRAPH_MAX_DEPTH}"}), 400
+        try:
+                since = _parse_time(request.args.get("since"))
+                until = _parse_time(request.args.get("until"))
+        except ValueError:
+                return jsonify({"error": "since and until must be ISO 8601 timestamps"}), 400
+        db = next(get_db())
+        reached = service.get_contacts_within(db, person_id, depth, since, until)
+        contacts = sorted(reached.items(), key=lambda item: (item[1], item[0]))
+        return jsonify({
+                "person_id": person_id,
+                "contacts": [{"person_id": p, "depth": d} for p, d in contacts],
+        })
+
+@connection_blueprint.route("/connections/graph/stats", methods=["GET"])
+def get_contact_graph_stats():
+        """
+        Contact graph index statistics
+        ---
+        tags:
+            - connections
+        responses:
+            200:
+                description: Persons, edges, edges not yet compacted and array memory of the in-memory contact graph
         """
         db = next(get_db())
-    results = service.get_all_connections(db)
-    return jsonify([{"id": c.id, "person_id": c.person_id, "location_id": c.location_id, "creation_time": c.creation_time.isoformat()} for c in results])
+        return jsonify(service.get_contact_graph_stats(db))
 if __name__ == "__main__":
+    grpc_server.serve()
     app.register_blueprint(connection_blueprint)
     app.run(host="0.0.0.0", port=5003)
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Vectorised distance engine for proximity filtering.
+
+Locations are held as column arrays (float64 latitude/longitude, int64
+id/person_id) and the distances from one or many query points to whole blocks
+of candidates are computed with NumPy, with no per-row Python loop.
+
+Two metrics are available: ``haversine`` (exact great-circle distance) and
+``equirectangular`` (a flat-earth approximation that is cheaper and accurate
+to well under a meter at the few-kilometer ranges proximity checks use).
+"""
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371008.8
+
+# Upper bound on query x point distances held in memory at once by the
+# many-to-many functions (16M float64 values = 128 MB).
+MAX_BLOCK_CELLS = 1 << 24
+
+
+def _haversine(phi1, lam1, cos_phi1, phi2, lam2, cos_phi2):
+    a = np.sin((phi2 - phi1) * 0.5) ** 2 + cos_phi1 * cos_phi2 * np.sin((lam2 - lam1) * 0.5) ** 2
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _equirectangular(phi1, lam1, cos_phi1, phi2, lam2):
+    # Scaling longitude by the query latitude's cosine is accurate for the
+    # short ranges this is meant for and avoids a cosine per row.
+    dlam = np.abs(lam2 - lam1)
+    dlam = np.minimum(dlam, 2.0 * np.pi - dlam)
+    x = dlam * cos_phi1
+    y = phi2 - phi1
+    return EARTH_RADIUS_METERS * np.sqrt(x * x + y * y)
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """Great-circle distance in meters; arguments broadcast like NumPy arrays."""
+    phi1 = np.radians(latitude)
+    phi2 = np.radians(latitudes)
+    return _haversine(phi1, np.radians(longitude), np.cos(phi1), phi2, np.radians(longitudes), np.cos(phi2))
+
+
+def equirectangular(latitude, longitude, latitudes, longitudes):
+    """Equirectangular approximation of the distance in meters."""
+    phi1 = np.radians(latitude)
+    return _equirectangular(phi1, np.radians(longitude), np.cos(phi1), np.radians(latitudes), np.radians(longitudes))
+
+
+METHODS = ("haversine", "equirectangular")
+
+
+class LocationColumns:
+    """Locations stored column-wise, with the trigonometry precomputed."""
+
+    def __init__(self, ids, person_ids, latitudes, longitudes):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.person_ids = np.asarray(person_ids, dtype=np.int64)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self._phi = np.radians(self.latitudes)
+        self._lam = np.radians(self.longitudes)
+        self._cos_phi = np.cos(self._phi)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from an iterable of ``(id, person_id, latitude, longitude)`` rows."""
+        rows = list(rows)
+        if not rows:
+            return cls([], [], [], [])
+        ids, person_ids, latitudes, longitudes = zip(*rows)
+        return cls(ids, person_ids, latitudes, longitudes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def take(self, index):
+        """Return the rows selected by an index or boolean mask as new columns."""
+        return LocationColumns(self.ids[index], self.person_ids[index], self.latitudes[index], self.longitudes[index])
+
+    def distances(self, latitude, longitude, method="haversine"):
+        """Distance in meters from one point to every row."""
+        phi = np.radians(latitude)
+        lam = np.radians(longitude)
+        if method == "haversine":
+            return _haversine(phi, lam, np.cos(phi), self._phi, self._lam, self._cos_phi)
+        if method == "equirectangular":
+            return _equirectangular(phi, lam, np.cos(phi), self._phi, self._lam)
+        raise ValueError(f"Unknown distance method {method!r}; expected one of {METHODS}")
+
+    def within(self, latitude, longitude, meters, method="haversine"):
+        """Return ``(indices, distances)`` of the rows within `meters` of the point, nearest first."""
+        distances = self.distances(latitude, longitude, method)
+        index = np.flatnonzero(distances <= meters)
+        order = np.argsort(distances[index], kind="stable")
+        return index[order], distances[index[order]]
+
+    def pairwise(self, latitudes, longitudes, method="haversine"):
+        """``(queries, rows)`` matrix of distances from many query points to every row."""
+        return self._pairwise(latitudes, longitudes, slice(None), method)
+
+    def _pairwise(self, latitudes, longitudes, rows, method):
+        phi = np.radians(np.asarray(latitudes, dtype=np.float64))[:, None]
+        lam = np.radians(np.asarray(longitudes, dtype=np.float64))[:, None]
+        if method == "haversine":
+            return _haversine(phi, lam, np.cos(phi), self._phi[rows], self._lam[rows], self._cos_phi[rows])
+        if method == "equirectangular":
+            return _equirectangular(phi, lam, np.cos(phi), self._phi[rows], self._lam[rows])
+        raise ValueError(f"Unknown distance method {method!r}; expected one of {METHODS}")
+
+    def within_many(self, latitudes, longitudes, meters, method="haversine"):
+        """All ``(query_index, row_index, distance)`` triples within `meters`.
+
+        The query x row matrix is evaluated in blocks of rows so memory stays
+        bounded by MAX_BLOCK_CELLS however large both sides are.
+        """
+        block = max(1, MAX_BLOCK_CELLS // max(1, len(latitudes)))
+        queries, rows, distances = [], [], []
+        for start in range(0, len(self), block):
+            matrix = self._pairwise(latitudes, longitudes, slice(start, start + block), method)
+            q, r = np.nonzero(matrix <= meters)
+            queries.append(q)
+            rows.append(r + start)
+            distances.append(matrix[q, r])
+        if not queries:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float64)
+        return np.concatenate(queries), np.concatenate(rows), np.concatenate(distances)
@@ -0,0 +1,260 @@
+"""
+In-memory contact graph for N-degree contact tracing.
+
+Detected contacts (connections rows with a contact_person_id) form an
+undirected graph of persons. It is held in CSR form: ``nodes`` holds the
+sorted person ids, the neighbours of node ``i`` are
+``neighbours[offsets[i]:offsets[i + 1]]`` (int32 node indices) and
+``edge_times`` holds the contact time of each entry in uint32 epoch seconds,
+so each undirected edge costs 16 bytes.
+
+Rows added after the last build are kept in a small per-person delta and
+folded into a fresh CSR once it exceeds GRAPH_REBUILD_EDGES. Every refresh
+publishes a new immutable snapshot, so traversals never need a lock.
+
+Ids are handed out when a row is inserted, not when it commits, so a
+transaction can commit a row below ids already read. Each refresh therefore
+re-reads the last GRAPH_REFRESH_OVERLAP_IDS ids and skips the rows it
+already holds, and the graph is reloaded from scratch every
+GRAPH_RELOAD_SECONDS to pick up anything that committed later still.
+"""
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+import models
+
+# Edges buffered in the delta before the CSR arrays are rebuilt.
+REBUILD_EDGES = int(os.environ.get("GRAPH_REBUILD_EDGES", "200000"))
+# Minimum seconds between two incremental refreshes from the database.
+REFRESH_SECONDS = float(os.environ.get("GRAPH_REFRESH_SECONDS", "5"))
+# Ids below the highest one read that each refresh reads again.
+REFRESH_OVERLAP_IDS = int(os.environ.get("GRAPH_REFRESH_OVERLAP_IDS", "10000"))
+# Seconds between two full reloads of the graph.
+RELOAD_SECONDS = float(os.environ.get("GRAPH_RELOAD_SECONDS", "3600"))
+LOAD_CHUNK_ROWS = 100000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(value):
+    # Rows written before creation_time was always set count as the epoch.
+    if value is None:
+        return 0
+    return int((value - _EPOCH).total_seconds())
+
+
+def _index_nodes(sources, targets):
+    """Sorted distinct person ids and the int32 node index of every endpoint."""
+    if not len(sources):
+        empty = np.empty(0, dtype=np.int32)
+        return np.empty(0, dtype=np.int64), empty, empty
+    top = int(max(sources.max(), targets.max()))
+    if 0 <= min(sources.min(), targets.min()) and top <= 4 * len(sources):
+        # Serial ids are dense, so a lookup table beats sorting the endpoints.
+        seen = np.zeros(top + 1, dtype=bool)
+        seen[sources] = True
+        seen[targets] = True
+        lookup = np.cumsum(seen, dtype=np.int32) - 1
+        return np.flatnonzero(seen), lookup[sources], lookup[targets]
+    nodes = np.unique(np.concatenate([sources, targets]))
+    return (
+        nodes,
+        np.searchsorted(nodes, sources).astype(np.int32),
+        np.searchsorted(nodes, targets).astype(np.int32),
+    )
+
+
+class Snapshot:
+    """One immutable version of the graph."""
+
+    def __init__(self, nodes, offsets, neighbours, edge_times, delta, last_id, recent_ids=frozenset()):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.neighbours = neighbours
+        self.edge_times = edge_times
+        # person id -> list of (neighbour person id, seconds) not yet in the CSR
+        self.delta = delta
+        self.delta_edges = sum(len(edges) for edges in delta.values()) // 2
+        self.last_id = last_id
+        # Ids of the rows held within REFRESH_OVERLAP_IDS of last_id.
+        self.recent_ids = recent_ids
+
+    @classmethod
+    def build(cls, sources, targets, seconds, last_id, recent_ids=frozenset()):
+        """Build the CSR arrays from undirected edge lists of person ids."""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        seconds = np.asarray(seconds, dtype=np.uint32)
+        # A person is never their own contact.
+        distinct = sources != targets
+        if not distinct.all():
+            sources, targets, seconds = sources[distinct], targets[distinct], seconds[distinct]
+        nodes, src, dst = _index_nodes(sources, targets)
+        del sources, targets
+        # Store both directions, grouped by source node.
+        heads = np.concatenate([src, dst])
+        tails = np.concatenate([dst, src])
+        del src, dst
+        order = np.argsort(heads)
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(heads, minlength=len(nodes)), out=offsets[1:])
+        del heads
+        return cls(nodes, offsets, tails[order], np.concatenate([seconds, seconds])[order], {}, last_id, recent_ids)
+
+    @property
+    def edges(self):
+        return len(self.neighbours) // 2 + self.delta_edges
+
+    @property
+    def nbytes(self):
+        return self.nodes.nbytes + self.offsets.nbytes + self.neighbours.nbytes + self.edge_times.nbytes
+
+    def edge_arrays(self):
+        """Undirected CSR and delta edges as ``(sources, targets, seconds)`` person id arrays."""
+        heads = np.repeat(np.arange(len(self.nodes), dtype=np.int32), np.diff(self.offsets))
+        forward = heads < self.neighbours
+        sources = [self.nodes[heads[forward]]]
+        targets = [self.nodes[self.neighbours[forward]]]
+        seconds = [self.edge_times[forward]]
+        for person_id, edges in self.delta.items():
+            kept = [(other, s) for other, s in edges if person_id < other]
+            if kept:
+                sources.append(np.full(len(kept), person_id, dtype=np.int64))
+                targets.append(np.array([other for other, _ in kept], dtype=np.int64))
+                seconds.append(np.array([s for _, s in kept], dtype=np.uint32))
+        return np.concatenate(sources), np.concatenate(targets), np.concatenate(seconds)
+
+    def traverse(self, person_id, max_depth, since=None, until=None):
+        """Breadth-first search from `person_id` over contacts at ``since <= time < until``, to the second.
+
+        Returns ``{person_id: depth}`` for every person reached within
+        `max_depth` hops, excluding the start.
+        """
+        lo = 0 if since is None else _seconds(since)
+        hi = 2 ** 32 if until is None else _seconds(until)
+        depths = {}
+        frontier = np.array([person_id], dtype=np.int64)
+        visited = frontier
+        for depth in range(1, max_depth + 1):
+            found = [self._csr_neighbours(frontier, lo, hi)]
+            if self.delta:
+                for source in frontier.tolist():
+                    edges = self.delta.get(source)
+                    if edges:
+                        found.append(np.array([other for other, s in edges if lo <= s < hi], dtype=np.int64))
+            frontier = np.setdiff1d(np.concatenate(found), visited)
+            if not len(frontier):
+                break
+            visited = np.union1d(visited, frontier)
+            depths.update(dict.fromkeys(frontier.tolist(), depth))
+        return depths
+
+    def _csr_neighbours(self, person_ids, lo, hi):
+        if not len(self.nodes):
+            return np.empty(0, dtype=np.int64)
+        index = np.searchsorted(self.nodes, person_ids)
+        index = index[(index < len(self.nodes)) & (self.nodes[np.minimum(index, len(self.nodes) - 1)] == person_ids)]
+        starts = self.offsets[index]
+        counts = self.offsets[index + 1] - starts
+        # Gather the adjacency ranges of all frontier nodes at once.
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        times = self.edge_times[positions]
+        return self.nodes[self.neighbours[positions[(times >= lo) & (times < hi)]]]
+
+
+class ContactGraph:
+    """Keeps the latest Snapshot built from the connections table."""
+
+    def __init__(self):
+        self.snapshot = None
+        self.refreshed_at = 0.0
+        self.loaded_at = 0.0
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def _new_rows(self, db, after_id):
+        Connection = models.Connection
+        return (
+            db.query(Connection.id, Connection.person_id, Connection.contact_person_id, Connection.creation_time)
+            .filter(Connection.id > after_id, Connection.contact_person_id.isnot(None))
+            .order_by(Connection.id)
+            .yield_per(LOAD_CHUNK_ROWS)
+        )
+
+    def _build(self, db):
+        """A fresh snapshot of every contact row."""
+        sources, targets, seconds, ids = array("q"), array("q"), array("L"), array("q")
+        for row in self._new_rows(db, 0):
+            sources.append(row.person_id)
+            targets.append(row.contact_person_id)
+            seconds.append(_seconds(row.creation_time))
+            ids.append(row.id)
+        last_id = ids[-1] if ids else 0
+        recent_ids = frozenset(i for i in ids[-REFRESH_OVERLAP_IDS:] if i > last_id - REFRESH_OVERLAP_IDS)
+        return Snapshot.build(sources, targets, seconds, last_id, recent_ids)
+
+    def load(self, db):
+        """Build a fresh snapshot from every contact row and publish it.
+
+        The build runs without the lock, so traversals and incremental
+        refreshes keep using the current snapshot until the new one is swapped in.
+        """
+        snapshot = self._build(db)
+        with self._lock:
+            self.snapshot = snapshot
+            self.refreshed_at = self.loaded_at = time.monotonic()
+            self._reloading = False
+        return snapshot
+
+    def refresh(self, db, force=False):
+        """Return the current snapshot, first folding in rows added since the last refresh."""
+        with self._lock:
+            if self.snapshot is None:
+                # Nothing to serve yet, so every caller waits for the first build.
+                self.snapshot = self._build(db)
+                self.refreshed_at = self.loaded_at = time.monotonic()
+                return self.snapshot
+            reload = not self._reloading and time.monotonic() - self.loaded_at >= RELOAD_SECONDS
+            if reload:
+                self._reloading = True
+        if reload:
+            try:
+                return self.load(db)
+            except Exception:
+                with self._lock:
+                    self._reloading = False
+                raise
+        with self._lock:
+            if not force and time.monotonic() - self.refreshed_at < REFRESH_SECONDS:
+                return self.snapshot
+            current = self.snapshot
+            rows = [
+                row for row in self._new_rows(db, max(0, current.last_id - REFRESH_OVERLAP_IDS))
+                if row.id not in current.recent_ids
+            ]
+            self.refreshed_at = time.monotonic()
+            if not rows:
+                return current
+            delta = {person_id: list(edges) for person_id, edges in current.delta.items()}
+            for row in rows:
+                if row.person_id == row.contact_person_id:
+                    continue
+                s = _seconds(row.creation_time)
+                delta.setdefault(row.person_id, []).append((row.contact_person_id, s))
+                delta.setdefault(row.contact_person_id, []).append((row.person_id, s))
+            last_id = max(current.last_id, rows[-1].id)
+            recent_ids = frozenset(
+                i for i in current.recent_ids.union(row.id for row in rows) if i > last_id - REFRESH_OVERLAP_IDS
+            )
+            snapshot = Snapshot(
+                current.nodes, current.offsets, current.neighbours, current.edge_times, delta, last_id, recent_ids,
+            )
+            if snapshot.delta_edges > REBUILD_EDGES:
+                snapshot = Snapshot.build(*snapshot.edge_arrays(), last_id, recent_ids)
+            self.snapshot = snapshot
+            return snapshot
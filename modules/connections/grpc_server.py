@@ -0,0 +1,73 @@
+"""
+gRPC LocationService server.
+
+Runs next to the Flask app in the connections service and answers
+``GetNearbyPeople`` with a server stream, so large result sets reach the
+caller incrementally. Requests are served from a thread pool, each with its
+own database session.
+"""
+import logging
+import os
+from concurrent import futures
+from datetime import datetime, timezone
+
+import grpc
+
+import location_connection_pb2
+import location_connection_pb2_grpc
+import service
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+GRPC_PORT = int(os.environ.get("GRPC_PORT", "50051"))
+GRPC_MAX_WORKERS = int(os.environ.get("GRPC_MAX_WORKERS", "16"))
+NEARBY_MAX_METERS = int(os.environ.get("NEARBY_MAX_METERS", "50000"))
+
+
+def _parse_time(value):
+    """Parse an optional ISO 8601 string into a naive UTC datetime."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class LocationServicer(location_connection_pb2_grpc.LocationServiceServicer):
+
+    def GetNearbyPeople(self, request, context):
+        if not 0 < request.distance <= NEARBY_MAX_METERS:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"distance must be between 1 and {NEARBY_MAX_METERS} meters")
+        try:
+            start = _parse_time(request.start)
+            end = _parse_time(request.end)
+        except ValueError:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "start and end must be ISO 8601 timestamps")
+
+        db = SessionLocal()
+        try:
+            for distance, location in service.find_nearby_people(db, request.person_id, request.distance, start, end):
+                if not context.is_active():
+                    break
+                yield location_connection_pb2.NearbyPerson(
+                    person_id=location.person_id,
+                    location_id=location.id,
+                    creation_time=location.creation_time.isoformat(),
+                    latitude=location.latitude,
+                    longitude=location.longitude,
+                    distance=distance,
+                )
+        finally:
+            db.close()
+
+
+def serve(port=GRPC_PORT, max_workers=GRPC_MAX_WORKERS):
+    """Start the gRPC server in the background and return it."""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    location_connection_pb2_grpc.add_LocationServiceServicer_to_server(LocationServicer(), server)
+    server.add_insecure_port(f"[::]:{port}")
+    server.start()
+    logger.info("gRPC LocationService listening on port %d", port)
+    return server
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x19location_connection.proto\x12\x0b\x63onnections\"6\n\x0fLocationRequest\x12\x11\n\tperson_id\x18\x01 \x01(\t\x12\x10\n\x08\x64istance\x18\x02 \x01(\x05\"M\n\x0cNearbyPerson\x12\x11\n\tperson_id\x18\x01 \x01(\t\x12\x13\n\x0blocation_id\x18\x02 \x01(\t\x12\x15\n\rcreation_time\x18\x03 \x01(\t2]\n\x0fLocationService\x12J\n\x0fGetNearbyPeople\x12\x1c.connections.LocationRequest\x1a\x19.connections.NearbyPersonb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x19location_connection.proto\x12\x0b\x63onnections\"R\n\x0fLocationRequest\x12\x11\n\tperson_id\x18\x01 \x01(\x03\x12\x10\n\x08\x64istance\x18\x02 \x01(\x05\x12\r\n\x05start\x18\x03 \x01(\t\x12\x0b\n\x03\x65nd\x18\x04 \x01(\t\"\x84\x01\n\x0cNearbyPerson\x12\x11\n\tperson_id\x18\x01 \x01(\x03\x12\x13\n\x0blocation_id\x18\x02 \x01(\x03\x12\x15\n\rcreation_time\x18\x03 \x01(\t\x12\x10\n\x08latitude\x18\x04 \x01(\x01\x12\x11\n\tlongitude\x18\x05 \x01(\x01\x12\x10\n\x08\x64istance\x18\x06 \x01(\x01\x32_\n\x0fLocationService\x12L\n\x0fGetNearbyPeople\x12\x1c.connections.LocationRequest\x1a\x19.connections.NearbyPerson0\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -32,9 +32,9 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'location_connection_pb2', _
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_LOCATIONREQUEST']._serialized_start=42
-  _globals['_LOCATIONREQUEST']._serialized_end=96
-  _globals['_NEARBYPERSON']._serialized_start=98
-  _globals['_NEARBYPERSON']._serialized_end=175
-  _globals['_LOCATIONSERVICE']._serialized_start=177
-  _globals['_LOCATIONSERVICE']._serialized_end=270
+  _globals['_LOCATIONREQUEST']._serialized_end=124
+  _globals['_NEARBYPERSON']._serialized_start=127
+  _globals['_NEARBYPERSON']._serialized_end=259
+  _globals['_LOCATIONSERVICE']._serialized_start=261
+  _globals['_LOCATIONSERVICE']._serialized_end=356
 # @@protoc_insertion_point(module_scope)
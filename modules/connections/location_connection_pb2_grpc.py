@@ -3,7 +3,11 @@
 import grpc
 import warnings
 
-from modules.connections import location_connection_pb2 as location__connection__pb2
+try:
+    # Package layout used by the api-gateway image.
+    from modules.connections import location_connection_pb2 as location__connection__pb2
+except ImportError:
+    import location_connection_pb2 as location__connection__pb2
 
 GRPC_GENERATED_VERSION = '1.74.0'
 GRPC_VERSION = grpc.__version__
@@ -34,7 +38,7 @@ class LocationServiceStub(object):
         Args:
             channel: A grpc.Channel.
         """
-        self.GetNearbyPeople = channel.unary_unary(
+        self.GetNearbyPeople = channel.unary_stream(
                 '/connections.LocationService/GetNearbyPeople',
                 request_serializer=location__connection__pb2.LocationRequest.SerializeToString,
                 response_deserializer=location__connection__pb2.NearbyPerson.FromString,
@@ -53,7 +57,7 @@ class LocationServiceServicer(object):
 
 def add_LocationServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
-            'GetNearbyPeople': grpc.unary_unary_rpc_method_handler(
+            'GetNearbyPeople': grpc.unary_stream_rpc_method_handler(
                     servicer.GetNearbyPeople,
                     request_deserializer=location__connection__pb2.LocationRequest.FromString,
                     response_serializer=location__connection__pb2.NearbyPerson.SerializeToString,
@@ -80,7 +84,7 @@ class LocationService(object):
             wait_for_ready=None,
             timeout=None,
             metadata=None):
-        return grpc.experimental.unary_unary(
+        return grpc.experimental.unary_stream(
             request,
             target,
             '/connections.LocationService/GetNearbyPeople',
@@ -0,0 +1,92 @@
+"""
+Idempotent schema upgrades for the connections table.
+
+``Base.metadata.create_all`` only creates tables that do not exist yet, so
+columns and indexes added to an existing deployment are applied here.
+
+Sightings are unique per (person_id, location_id). A table holding
+duplicates from before that rule cannot take the unique index, and startup
+leaves it without one rather than deleting rows; an operator removes the
+duplicates and creates the index with ``python migrate.py dedupe-sightings``.
+"""
+import argparse
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+UPGRADES = [
+    "ALTER TABLE connections ADD COLUMN IF NOT EXISTS contact_person_id INTEGER",
+    "ALTER TABLE connections ADD COLUMN IF NOT EXISTS contact_location_id INTEGER",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_connections_contact ON connections (location_id, contact_location_id) "
+    "WHERE contact_location_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS ix_connections_person_id_creation_time ON connections (person_id, creation_time)",
+    "CREATE INDEX IF NOT EXISTS ix_connections_contact_person_id_creation_time "
+    "ON connections (contact_person_id, creation_time)",
+    "CREATE INDEX IF NOT EXISTS ix_connections_location_id ON connections (location_id)",
+]
+
+# Rows written before sightings were unique; the earliest copy is kept.
+DEDUPLICATE_SIGHTINGS = (
+    "DELETE FROM connections a USING connections b "
+    "WHERE a.contact_location_id IS NULL AND b.contact_location_id IS NULL "
+    "AND a.person_id = b.person_id AND a.location_id = b.location_id AND a.id > b.id"
+)
+DUPLICATE_SIGHTING = (
+    "SELECT 1 FROM connections WHERE contact_location_id IS NULL "
+    "GROUP BY person_id, location_id HAVING count(*) > 1 LIMIT 1"
+)
+SIGHTING_INDEX = (
+    "CREATE UNIQUE INDEX uq_connections_sighting ON connections (person_id, location_id) "
+    "WHERE contact_location_id IS NULL"
+)
+
+
+def _has_sighting_index(conn):
+    return conn.execute(text("SELECT to_regclass('uq_connections_sighting')")).scalar() is not None
+
+
+def upgrade(engine):
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for statement in UPGRADES:
+            conn.execute(text(statement))
+        if _has_sighting_index(conn):
+            return
+        if conn.execute(text(DUPLICATE_SIGHTING)).scalar():
+            logger.warning(
+                "connections holds duplicate sightings, so uq_connections_sighting was not created; "
+                "run `python migrate.py dedupe-sightings` to remove them and create it"
+            )
+            return
+        conn.execute(text(SIGHTING_INDEX))
+
+
+def dedupe_sightings(engine):
+    """Delete duplicate sightings, keeping the earliest, and create their unique index."""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        if _has_sighting_index(conn):
+            logger.info("uq_connections_sighting already exists")
+            return
+        deleted = conn.execute(text(DEDUPLICATE_SIGHTINGS)).rowcount
+        conn.execute(text(SIGHTING_INDEX))
+    logger.info("Deleted %d duplicate sightings and created uq_connections_sighting", deleted)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "command", nargs="?", choices=["upgrade", "dedupe-sightings"], default="upgrade",
+        help="apply the schema upgrades (default), or delete duplicate sightings and index them",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "dedupe-sightings":
+        dedupe_sightings(engine)
+    else:
+        upgrade(engine)
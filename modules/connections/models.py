@@ -1,10 +1,46 @@
-from sqlalchemy import Column, Integer, Float, DateTime
+from sqlalchemy import Column, Integer, BigInteger, Float, DateTime, Index, text
+from sqlalchemy.ext.declarative import declarative_base
 from database import Base
 from datetime import datetime
 
 class Connection(Base):
     __tablename__ = "connections"
+    __table_args__ = (
+        # A detected contact is stored once per pair of locations.
+        Index(
+            "uq_connections_contact", "location_id", "contact_location_id", unique=True,
+            postgresql_where=text("contact_location_id IS NOT NULL"),
+            sqlite_where=text("contact_location_id IS NOT NULL"),
+        ),
+        # A plain sighting is stored once per person and location.
+        Index(
+            "uq_connections_sighting", "person_id", "location_id", unique=True,
+            postgresql_where=text("contact_location_id IS NULL"),
+            sqlite_where=text("contact_location_id IS NULL"),
+        ),
+        # Per-person history from either side of a contact, in time order.
+        Index("ix_connections_person_id_creation_time", "person_id", "creation_time"),
+        Index("ix_connections_contact_person_id_creation_time", "contact_person_id", "creation_time"),
+        Index("ix_connections_location_id", "location_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     person_id = Column(Integer, nullable=False)
     location_id = Column(Integer, nullable=False)
-    creation_time = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    creation_time = Column(DateTime, default=datetime.utcnow)
+    # Set on contacts detected from location data: the other person and location.
+    contact_person_id = Column(Integer)
+    contact_location_id = Column(Integer)
+
+
+# Read-only mapping of the table owned by the locations service. It lives on
+# its own declarative base so create_all here never creates or alters it.
+LocationBase = declarative_base()
+
+class Location(LocationBase):
+    __tablename__ = "location"
+    id = Column(Integer, primary_key=True)
+    person_id = Column(Integer, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    grid_cell = Column(BigInteger, index=True)
+    creation_time = Column(DateTime, nullable=False)
@@ -0,0 +1,37 @@
+"""
+Batched person lookups against the persons service, used to expand
+connection listings with person details.
+"""
+import os
+
+import requests
+
+PERSONS_SERVICE_URL = os.environ.get("PERSONS_SERVICE_URL", "http://persons:5000")
+PERSONS_TIMEOUT_SECONDS = float(os.environ.get("PERSONS_TIMEOUT_SECONDS", "5"))
+# Ids per request; matches the persons service PERSON_IDS_MAX default.
+PERSONS_IDS_PER_REQUEST = int(os.environ.get("PERSONS_IDS_PER_REQUEST", "1000"))
+
+_session = requests.Session()
+
+
+class PersonsUnavailable(Exception):
+    pass
+
+
+def get_persons(person_ids):
+    """Return ``{id: person}`` for the ids that exist, with one request per PERSONS_IDS_PER_REQUEST ids."""
+    ids = sorted(set(person_ids))
+    persons = {}
+    for start in range(0, len(ids), PERSONS_IDS_PER_REQUEST):
+        chunk = ids[start:start + PERSONS_IDS_PER_REQUEST]
+        try:
+            response = _session.get(
+                f"{PERSONS_SERVICE_URL}/persons",
+                params={"ids": ",".join(map(str, chunk))},
+                timeout=PERSONS_TIMEOUT_SECONDS,
+            )
+            response.raise_for_status()
+            persons.update((person["id"], person) for person in response.json())
+        except (requests.RequestException, ValueError) as e:
+            raise PersonsUnavailable(str(e)) from e
+    return persons
@@ -1,15 +1,36 @@
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, Field, field_validator, model_validator
+from datetime import datetime, timezone
+from typing import Optional
 
 class ConnectionCreate(BaseModel):
     person_id: int
     location_id: int
+    creation_time: datetime = Field(default_factory=datetime.utcnow)
+    # Both set for a detected contact, both left out for a plain sighting.
+    contact_person_id: Optional[int] = None
+    contact_location_id: Optional[int] = None
+
+    @field_validator("creation_time")
+    @classmethod
+    def naive_utc(cls, value: datetime) -> datetime:
+        # The column stores naive UTC timestamps.
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @model_validator(mode="after")
+    def contact_pair(self):
+        if (self.contact_person_id is None) != (self.contact_location_id is None):
+            raise ValueError("contact_person_id and contact_location_id must be given together")
+        return self
 
 class ConnectionRead(BaseModel):
     id: int
     person_id: int
     location_id: int
     creation_time: datetime
+    contact_person_id: Optional[int] = None
+    contact_location_id: Optional[int] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
@@ -1,12 +1,161 @@
+import os
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-import models, schema
+import distance, graph, models, schema, spatial, versions
+
+# Rows fetched per round trip from the server-side cursor when streaming.
+STREAM_CHUNK_ROWS = int(os.environ.get("CONNECTION_STREAM_CHUNK_ROWS", "1000"))
+# Rows per INSERT statement in bulk upserts.
+BATCH_CHUNK_ROWS = int(os.environ.get("CONNECTION_BATCH_CHUNK_ROWS", "1000"))
+# Candidate locations distance-checked per NumPy block in proximity searches.
+NEARBY_BLOCK_ROWS = int(os.environ.get("NEARBY_BLOCK_ROWS", "10000"))
+# Time window searched when a proximity request does not give one.
+NEARBY_DEFAULT_WINDOW = timedelta(hours=int(os.environ.get("NEARBY_DEFAULT_WINDOW_HOURS", "24")))
+
+# Contact graph shared by all requests in this process.
+_graph = graph.ContactGraph()
+_version = versions.TableVersion(models.Connection.id)
 
 def create_connection(db: Session, connection: schema.ConnectionCreate):
-    db_connection = models.Connection(**connection.dict())
-    db.add(db_connection)
+    """Store a connection, or return the stored one if this sighting or contact already exists."""
+    row = connection.dict()
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(models.Connection).values(**row).on_conflict_do_nothing().returning(models.Connection.id)
+    connection_id = db.execute(statement).scalar()
+    db.commit()
+    if connection_id is None:
+        query = db.query(models.Connection).filter(models.Connection.location_id == row["location_id"])
+        if row["contact_location_id"] is None:
+            query = query.filter(
+                models.Connection.person_id == row["person_id"], models.Connection.contact_location_id.is_(None),
+            )
+        else:
+            query = query.filter(models.Connection.contact_location_id == row["contact_location_id"])
+        return query.order_by(models.Connection.id).first()
+    _version.invalidate()
+    return db.get(models.Connection, connection_id)
+
+def upsert_connections(db: Session, rows):
+    """Insert connection rows, skipping any already stored. Returns the number inserted.
+
+    Sightings are unique per (person_id, location_id) and contacts per
+    (location_id, contact_location_id), so replaying rows is a no-op.
+    """
+    if not rows:
+        return 0
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(models.Connection).on_conflict_do_nothing().returning(models.Connection.id)
+    inserted = 0
+    for start in range(0, len(rows), BATCH_CHUNK_ROWS):
+        inserted += len(db.execute(statement, rows[start:start + BATCH_CHUNK_ROWS]).all())
     db.commit()
-    db.refresh(db_connection)
-    return db_connection
+    _version.invalidate()
+    return inserted
+
+def get_list_version(db: Session):
+    return _version.get(db)
 
 def get_all_connections(db: Session):
-    return db.query(models.Connection).all()
\ No newline at end of file
+    return db.query(models.Connection).all()
+
+def get_connections_page(db: Session, after_id: int, limit: int):
+    return (
+        db.query(models.Connection)
+        .filter(models.Connection.id > after_id)
+        .order_by(models.Connection.id)
+        .limit(limit)
+        .all()
+    )
+
+def get_person_connections(db: Session, person_id: int, since=None, until=None, limit=None, newest_first=False):
+    """Connections where `person_id` is on either side, oldest first unless `newest_first`.
+
+    Each side is served by its (person, creation_time) index, read backwards for `newest_first`.
+    """
+    Connection = models.Connection
+    query = db.query(Connection).filter(or_(Connection.person_id == person_id, Connection.contact_person_id == person_id))
+    if since is not None:
+        query = query.filter(Connection.creation_time >= since)
+    if until is not None:
+        query = query.filter(Connection.creation_time < until)
+    if newest_first:
+        query = query.order_by(Connection.creation_time.desc(), Connection.id.desc())
+    else:
+        query = query.order_by(Connection.creation_time, Connection.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def iter_connections(db: Session, after_id: int = 0):
+    """Yield connections in id order through a server-side cursor."""
+    return (
+        db.query(models.Connection)
+        .filter(models.Connection.id > after_id)
+        .order_by(models.Connection.id)
+        .yield_per(STREAM_CHUNK_ROWS)
+    )
+
+def find_nearby_people(db: Session, person_id: int, meters: float, start=None, end=None):
+    """Yield ``(distance, location)`` for other persons' locations near `person_id`.
+
+    A location matches when it lies within `meters` of any location of
+    `person_id`, and both fall in ``start <= creation_time < end`` (by default
+    the last NEARBY_DEFAULT_WINDOW). Candidates are read only from the grid
+    cells around the person's locations and checked in NumPy blocks, so
+    results are produced incrementally.
+    """
+    Location = models.Location
+    if end is None:
+        end = datetime.utcnow()
+    if start is None:
+        start = end - NEARBY_DEFAULT_WINDOW
+    in_window = (Location.creation_time >= start, Location.creation_time < end)
+    anchors = db.query(Location.latitude, Location.longitude).filter(Location.person_id == person_id, *in_window).all()
+    if not anchors:
+        return
+    anchor_lats = np.array([a.latitude for a in anchors])
+    anchor_lons = np.array([a.longitude for a in anchors])
+
+    cells = set()
+    for latitude, longitude in anchors:
+        cells.update(spatial.neighbour_cells(latitude, longitude, meters))
+    ranges = [Location.grid_cell.between(lo, hi) for lo, hi in spatial.cell_ranges(cells)]
+    candidates = (
+        db.query(Location.id, Location.person_id, Location.latitude, Location.longitude, Location.creation_time)
+        .filter(or_(*ranges), Location.person_id != person_id, *in_window)
+        .yield_per(STREAM_CHUNK_ROWS)
+    )
+
+    block = []
+    for row in candidates:
+        block.append(row)
+        if len(block) >= NEARBY_BLOCK_ROWS:
+            yield from _nearest_within(block, anchor_lats, anchor_lons, meters)
+            block = []
+    if block:
+        yield from _nearest_within(block, anchor_lats, anchor_lons, meters)
+
+def _nearest_within(rows, anchor_lats, anchor_lons, meters):
+    columns = distance.LocationColumns.from_rows((r.id, r.person_id, r.latitude, r.longitude) for r in rows)
+    _, hit_rows, hit_distances = columns.within_many(anchor_lats, anchor_lons, meters)
+    nearest = np.full(len(rows), np.inf)
+    np.minimum.at(nearest, hit_rows, hit_distances)
+    for index in np.flatnonzero(nearest <= meters):
+        yield float(nearest[index]), rows[index]
+
+def get_contacts_within(db: Session, person_id: int, depth: int, since=None, until=None):
+    """Return ``{person_id: hops}`` for everyone within `depth` contact hops of `person_id`."""
+    return _graph.refresh(db).traverse(person_id, depth, since, until)
+
+def get_contact_graph_stats(db: Session):
+    snapshot = _graph.refresh(db)
+    return {
+        "persons": len(snapshot.nodes),
+        "edges": snapshot.edges,
+        "pending_edges": snapshot.delta_edges,
+        "bytes": snapshot.nbytes,
+        "last_id": snapshot.last_id,
+    }
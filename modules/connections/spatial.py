@@ -0,0 +1,57 @@
+"""
+Fixed-cell spatial grid shared with the locations service.
+
+The locations service stores the grid cell of every row in the indexed
+``location.grid_cell`` column; these helpers compute the same cell ids so
+proximity queries here can read just the cells around a point. The cell size
+(LOCATION_GRID_CELL_DEGREES) must match the locations service setting.
+"""
+import math
+import os
+
+EARTH_RADIUS_METERS = 6371008.8
+# Meters per degree of latitude on the sphere haversine() measures on; a
+# larger value would size search windows smaller than the radius.
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_METERS / 360.0
+
+# Cell edge in degrees; 0.01 degrees is roughly 1.1 km of latitude.
+CELL_DEGREES = float(os.environ.get("LOCATION_GRID_CELL_DEGREES", "0.01"))
+
+COLUMNS = int(math.ceil(360.0 / CELL_DEGREES))
+
+
+def cell_for(latitude, longitude):
+    """Return the grid cell id of a coordinate."""
+    row = int(math.floor((latitude + 90.0) / CELL_DEGREES))
+    col = int(math.floor((longitude + 180.0) / CELL_DEGREES)) % COLUMNS
+    return row * COLUMNS + col
+
+
+def neighbour_cells(latitude, longitude, meters):
+    """Return every cell id that may hold a point within `meters` of the coordinate."""
+    dlat = meters / METERS_PER_DEGREE
+    # Longitude degrees shrink towards the poles, so size the window for the
+    # pole-ward edge of the search area.
+    cos_lat = math.cos(math.radians(min(abs(latitude) + dlat, 89.9)))
+    dlon = min(meters / (METERS_PER_DEGREE * cos_lat), 180.0)
+
+    row_lo = int(math.floor((max(latitude - dlat, -90.0) + 90.0) / CELL_DEGREES))
+    row_hi = int(math.floor((min(latitude + dlat, 90.0) + 90.0) / CELL_DEGREES))
+    col_lo = int(math.floor((longitude - dlon + 180.0) / CELL_DEGREES))
+    col_hi = int(math.floor((longitude + dlon + 180.0) / CELL_DEGREES))
+    if col_hi - col_lo + 1 >= COLUMNS:
+        cols = range(COLUMNS)
+    else:
+        cols = sorted({col % COLUMNS for col in range(col_lo, col_hi + 1)})
+    return [row * COLUMNS + col for row in range(row_lo, row_hi + 1) for col in cols]
+
+
+def cell_ranges(cells):
+    """Collapse cell ids into inclusive ``(lo, hi)`` ranges of consecutive ids."""
+    ranges = []
+    for cell in sorted(cells):
+        if ranges and cell == ranges[-1][1] + 1:
+            ranges[-1][1] = cell
+        else:
+            ranges.append([cell, cell])
+    return [tuple(r) for r in ranges]
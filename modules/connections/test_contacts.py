@@ -0,0 +1,31 @@
+import math
+
+import numpy as np
+
+import contacts
+import distance
+
+# Meters per degree on the haversine sphere, independent of the module under test.
+METERS_PER_DEGREE = 2 * math.pi * distance.EARTH_RADIUS_METERS / 360.0
+
+
+def _pair_at(meters, bearing, latitude=45.0, longitude=10.0):
+    """Two pings `meters` apart along `bearing` (radians from north)."""
+    dlat = math.cos(bearing) * meters / METERS_PER_DEGREE
+    dlon = math.sin(bearing) * meters / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+    return [latitude, latitude + dlat], [longitude, longitude + dlon]
+
+
+def test_pair_just_inside_radius_is_found():
+    for bearing in np.linspace(0, 2 * math.pi, 16, endpoint=False):
+        latitudes, longitudes = _pair_at(49.999, bearing)
+        assert distance.haversine(np.array(latitudes[:1]), np.array(longitudes[:1]),
+                                  np.array(latitudes[1:]), np.array(longitudes[1:]))[0] <= 50
+        a, b = contacts.find_contacts([1, 2], latitudes, longitudes, [0.0, 0.0], 50, 600)
+        assert len(a) == 1, bearing
+
+
+def test_pair_just_outside_radius_is_not_found():
+    latitudes, longitudes = _pair_at(50.01, 0.0)
+    a, b = contacts.find_contacts([1, 2], latitudes, longitudes, [0.0, 0.0], 50, 600)
+    assert len(a) == 0
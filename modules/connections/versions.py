@@ -0,0 +1,60 @@
+"""
+Cheap change version of a table for conditional GETs.
+
+Rows are only ever inserted, so the table has changed whenever its largest
+id has. That alone misses a transaction that commits a row below an id
+already seen (ids are handed out at insert time), so on PostgreSQL the
+version also carries the table's insert and delete counters from
+``pg_stat_user_tables``, summed over its partitions. Both come from catalog
+and index lookups, never a table scan. The counters reach the statistics
+views when the writing backend flushes them, typically within a few
+seconds, so such a late row can keep an old version for that long. Other
+databases count the rows instead.
+
+The version is read at most once per LIST_VERSION_TTL_SECONDS and reset by
+this process's own writes, so an unchanged poll costs one comparison, and
+writes by other processes (other replicas, the Kafka consumer, batch jobs)
+show up within the TTL.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import func, text
+
+TTL_SECONDS = float(os.environ.get("LIST_VERSION_TTL_SECONDS", "1"))
+
+_PG_WRITE_COUNTERS = text("""
+SELECT coalesce(sum(n_tup_ins), 0), coalesce(sum(n_tup_del), 0)
+FROM pg_stat_user_tables
+WHERE relid = to_regclass(:table)
+   OR relid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:table))
+""")
+
+
+class TableVersion:
+    def __init__(self, id_column, ttl=TTL_SECONDS):
+        self.id_column = id_column
+        self.ttl = ttl
+        self._value = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _read(self, db):
+        last_id = db.query(func.max(self.id_column)).scalar() or 0
+        if db.bind.dialect.name == "postgresql":
+            inserted, deleted = db.execute(_PG_WRITE_COUNTERS, {"table": self.id_column.table.name}).one()
+            return f"{last_id}.{inserted}.{deleted}"
+        return f"{last_id}.{db.query(func.count(self.id_column)).scalar()}"
+
+    def get(self, db):
+        now = time.monotonic()
+        if now - self._checked_at >= self.ttl:
+            with self._lock:
+                if now - self._checked_at >= self.ttl:
+                    self._value = self._read(db)
+                    self._checked_at = time.monotonic()
+        return self._value
+
+    def invalidate(self):
+        self._checked_at = float("-inf")
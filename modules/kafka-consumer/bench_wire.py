@@ -0,0 +1,59 @@
+"""
+Benchmark of the locations topic wire formats.
+
+Usage:
+    python bench_wire.py [--events 100000] [--batch 500]
+
+Encodes and decodes ``--events`` random location events as JSON and as
+LocationEvent protobuf through wire.py, and reports events per second each
+way and the bytes per event, both raw and with each batch of ``--batch``
+records gzip-compressed as the producer sends them.
+"""
+import argparse
+import gzip
+import random
+import time
+from datetime import datetime, timedelta
+
+import wire
+
+
+def events(count, rng):
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "person_id": rng.randint(1, 100000),
+            "latitude": rng.uniform(-90, 90),
+            "longitude": rng.uniform(-180, 180),
+            "creation_time": (start + timedelta(microseconds=rng.randint(0, 10**13))).isoformat(),
+        }
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    messages = events(args.events, random.Random(42))
+    for wire_format in ("json", "protobuf"):
+        started = time.perf_counter()
+        records = [wire.encode(message, wire_format) for message in messages]
+        encode_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        decoded = [wire.decode(value, headers) for value, headers in records]
+        decode_seconds = time.perf_counter() - started
+        assert decoded[0] == messages[0]
+        raw = sum(len(value) for value, _ in records)
+        compressed = sum(
+            len(gzip.compress(b"".join(value for value, _ in records[start:start + args.batch])))
+            for start in range(0, len(records), args.batch)
+        )
+        print(f"{wire_format:>8}: encode {args.events / encode_seconds:,.0f}/s  decode {args.events / decode_seconds:,.0f}/s  "
+              f"{raw / args.events:.1f} B/event  {compressed / args.events:.1f} B/event gzip")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,527 @@
+"""
+Kafka consumer: stores location events and detects contacts between them.
+
+Each worker is a member of the CONSUMER_GROUP_ID consumer group, so Kafka
+spreads the topic's partitions over every worker in every pod and offsets
+survive restarts. CONSUMER_WORKERS sets the worker processes per container;
+``auto`` starts one per partition of the topic.
+
+Contact detection needs the ``locations`` sink: contacts reference the
+location rows they were detected between, and only that sink stores them.
+It is per worker: it sees the partitions that worker owns, so with several
+workers two persons on different partitions are only paired by the batch
+contact job in the connections service.
+
+CONSUMER_SINK selects where events go. ``events`` (the default) stores each
+message in ``kafka_events``. ``locations`` validates each message as a
+location and bulk-inserts the valid ones into the ``location`` table with
+their grid cell, so Kafka can replace ``POST /locations`` for high-volume
+ingest; invalid messages are kept in ``kafka_events`` with the reason, and
+CONSUMER_AUDIT=1 keeps a copy of every message there too.
+
+Records are JSON or LocationEvent protobuf, as their content-type header
+says (wire.py); invalid ones are kept as text.
+
+Within a worker, polling, decoding and writing run on separate threads
+joined by bounded queues (see Worker), so a slow commit never stalls the
+poll loop past the group's session timeout.
+
+The main process also serves /healthz, /readyz and Prometheus /metrics
+(controller.py) from the snapshots every worker reports (metrics.py).
+"""
+import collections
 import json
-from kafka import KafkaConsumer
-from service import save_kafka_event
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+from kafka import ConsumerRebalanceListener, KafkaConsumer, KafkaProducer
+from kafka.errors import CommitFailedError, KafkaError
+from kafka.structs import OffsetAndMetadata, TopicPartition
+from pydantic import ValidationError
+from sqlalchemy.exc import OperationalError
+import controller, metrics, migrate, spatial, wire
+from database import engine
+from detector import ContactDetector, Event
+from schema import LocationEvent
+from service import event_row, save_batch, save_locations
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
+KAFKA_BOOTSTRAP_SERVERS = os.environ.get("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
+LOCATIONS_TOPIC = os.environ.get("LOCATIONS_TOPIC", "locations")
+CONSUMER_GROUP_ID = os.environ.get("CONSUMER_GROUP_ID", "udaconnect-consumer")
+# Where a new consumer group starts reading.
+CONSUMER_AUTO_OFFSET_RESET = os.environ.get("CONSUMER_AUTO_OFFSET_RESET", "earliest")
+# Worker processes in this container: a number, or "auto" for one per partition.
+CONSUMER_WORKERS = os.environ.get("CONSUMER_WORKERS", "1")
+# A batch is written once it holds this many records ...
+CONSUMER_BATCH_SIZE = int(os.environ.get("CONSUMER_BATCH_SIZE", "500"))
+# ... or this long after its first record arrived.
+CONSUMER_LINGER_MS = int(os.environ.get("CONSUMER_LINGER_MS", "200"))
+# Polled batches waiting to be decoded, and decoded batches waiting to be
+# written; once the first queue is full the worker pauses its partitions.
+CONSUMER_QUEUE_BATCHES = int(os.environ.get("CONSUMER_QUEUE_BATCHES", "4"))
+# Threads writing batches to the database in parallel, per worker. Each
+# partition is always written by the same thread, so its records are stored
+# in offset order.
+CONSUMER_WRITERS = int(os.environ.get("CONSUMER_WRITERS", "2"))
+# Delay between attempts to write a batch while the database is unreachable.
+CONSUMER_RETRY_SECONDS = float(os.environ.get("CONSUMER_RETRY_SECONDS", "2"))
+# Delay before a worker process that died is started again.
+CONSUMER_RESTART_SECONDS = float(os.environ.get("CONSUMER_RESTART_SECONDS", "5"))
+# How often each worker reports its metrics and partition lag.
+CONSUMER_METRICS_SECONDS = float(os.environ.get("CONSUMER_METRICS_SECONDS", "5"))
+# "events" stores raw messages in kafka_events, "locations" writes validated locations.
+CONSUMER_SINK = os.environ.get("CONSUMER_SINK", "events")
+# With the locations sink, also keep every raw message in kafka_events.
+CONSUMER_AUDIT = os.environ.get("CONSUMER_AUDIT", "0") == "1"
+# Detect contacts as locations arrive; only takes effect with the locations sink.
+CONTACT_DETECTION = os.environ.get("CONTACT_DETECTION", "1") == "1"
+# Detected contacts are also published here when set.
+CONNECTIONS_TOPIC = os.environ.get("CONNECTIONS_TOPIC", "")
+
+
+def _deserialize(message):
+    try:
+        return wire.decode(message.value, message.headers)
+    except ValueError:
+        # Kept as raw text so a malformed message is still recorded.
+        return message.value.decode("utf-8", errors="replace")
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def location_row(message):
+    """Validate a message as a location and return its ``location`` row; raises ValueError."""
+    if not isinstance(message.value, dict):
+        raise ValueError("message is not a JSON object")
+    try:
+        event = LocationEvent(**message.value)
+    except ValidationError as e:
+        raise ValueError(str(e)) from e
+    creation_time = event.creation_time
+    if creation_time is None:
+        creation_time = datetime.fromtimestamp(message.timestamp / 1000.0, timezone.utc).replace(tzinfo=None)
+    return {
+        "person_id": event.person_id,
+        "latitude": event.latitude,
+        "longitude": event.longitude,
+        "grid_cell": spatial.cell_for(event.latitude, event.longitude),
+        "creation_time": creation_time,
+    }
+
+
+class _FlushOnRevoke(ConsumerRebalanceListener):
+    def __init__(self, worker):
+        self.worker = worker
+
+    def on_partitions_revoked(self, revoked):
+        # Runs inside poll() before the partitions move to another member:
+        # store what was read from them and commit, so nothing is replayed.
+        if revoked:
+            logger.info("Partitions revoked: %s", sorted(tp.partition for tp in revoked))
+        self.worker.flush()
+        for tp in revoked:
+            self.worker.committed.pop(tp, None)
+
+    def on_partitions_assigned(self, assigned):
+        logger.info("Partitions assigned: %s", sorted(tp.partition for tp in assigned))
+        if self.worker.paused:
+            # A rebalance resumes everything; keep holding back while the stages are full.
+            self.worker.consumer.pause(*assigned)
+
+
+class Batch:
+    """Records polled together, tracked from the poll thread to their offset commit."""
+
+    def __init__(self, messages, writer=0):
+        self.messages = messages
+        # Index of the writer thread that stores this batch.
+        self.writer = writer
+        # Next offset to commit per partition once this batch is written.
+        self.offsets = {}
+        for message in messages:
+            tp = TopicPartition(message.topic, message.partition)
+            self.offsets[tp] = max(self.offsets.get(tp, 0), message.offset + 1)
+        self.write = None
+        self.contacts = []
+        self.written = False
+        self.error = None
+
+
+class Worker:
+    """One group member, run as three stages joined by bounded queues.
+
+    The calling thread polls Kafka, hands batches to a decode thread and
+    commits offsets; the decode thread parses and validates records; a pool
+    of CONSUMER_WRITERS threads writes them. A polled batch is split by
+    partition over the writers, partition ``p`` going to writer
+    ``p % CONSUMER_WRITERS``, so batches only run in parallel when they hold
+    different partitions. Offsets are committed in poll order once every
+    earlier batch is written, and while the decode queue is full the worker
+    pauses its partitions, so a slow database holds back fetching instead of
+    blocking the poll loop.
+    """
+
+    def __init__(self, consumer, detector=None, producer=None, report=None, name="consumer"):
+        self.consumer = consumer
+        self.detector = detector
+        self.producer = producer
+        self.pending = []
+        self.running = True
+        # Batches split from the last poll that the decode queue has not taken yet.
+        self.held = []
+        self.paused = False
+        self.error = None
+        # Offsets this worker committed, per partition it still owns.
+        self.committed = {}
+        self.metrics = metrics.WorkerMetrics(name)
+        self.report = report
+        self.reported_at = float("-inf")
+        self.in_flight = collections.deque()
+        self.decode_queue = queue.Queue(CONSUMER_QUEUE_BATCHES)
+        self.write_queues = [queue.Queue(CONSUMER_QUEUE_BATCHES) for _ in range(CONSUMER_WRITERS)]
+        self.done = queue.Queue()
+        self.detect_lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.decode_loop, name="decode", daemon=True)]
+        self.threads += [
+            threading.Thread(target=self.write_loop, args=(index,), name=f"writer-{index}", daemon=True)
+            for index in range(CONSUMER_WRITERS)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def poll_batch(self):
+        """Add up to CONSUMER_BATCH_SIZE records to `pending`, waiting at most CONSUMER_LINGER_MS after the first.
+
+        Leaves `pending` empty when nothing arrived within CONSUMER_LINGER_MS.
+        """
+        deadline = None
+        while self.running and len(self.pending) < CONSUMER_BATCH_SIZE:
+            if deadline is None:
+                timeout_ms = CONSUMER_LINGER_MS
+            else:
+                timeout_ms = int((deadline - time.monotonic()) * 1000)
+                if timeout_ms <= 0:
+                    break
+            records = self.consumer.poll(timeout_ms=timeout_ms, max_records=CONSUMER_BATCH_SIZE - len(self.pending))
+            for partition_records in records.values():
+                self.pending.extend(partition_records)
+            if not self.pending:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + CONSUMER_LINGER_MS / 1000.0
+
+    def hand_off(self, block=False):
+        """Move the pending records into the decode queue, pausing fetching while it is full."""
+        if not self.held and self.pending:
+            self.held, self.pending = self.split(self.pending), []
+        while self.held:
+            try:
+                self.decode_queue.put(self.held[0], block=block)
+            except queue.Full:
+                if not self.paused:
+                    self.paused = self.metrics.paused = True
+                    self.consumer.pause(*self.consumer.assignment())
+                    logger.info("Pipeline full, pausing partitions")
+                return
+            self.in_flight.append(self.held.pop(0))
+        if self.paused:
+            self.paused = self.metrics.paused = False
+            self.consumer.resume(*self.consumer.paused())
+            logger.info("Pipeline drained, resuming partitions")
+
+    @staticmethod
+    def split(messages):
+        """One Batch per writer that owns partitions among `messages`, records kept in poll order."""
+        groups = {}
+        for message in messages:
+            groups.setdefault(message.partition % CONSUMER_WRITERS, []).append(message)
+        return [Batch(group, writer) for writer, group in groups.items()]
+
+    def commit_written(self):
+        """Commit the offsets of the written batches that every earlier batch precedes."""
+        while True:
+            try:
+                batch = self.done.get_nowait()
+            except queue.Empty:
+                break
+            self.check(batch)
+        offsets, contacts = {}, []
+        while self.in_flight and self.in_flight[0].written:
+            batch = self.in_flight.popleft()
+            offsets.update(batch.offsets)
+            contacts.extend(batch.contacts)
+        if not offsets:
+            return
+        try:
+            self.consumer.commit({tp: OffsetAndMetadata(offset, "", -1) for tp, offset in offsets.items()})
+            self.committed.update(offsets)
+            self.metrics.observe_commit()
+        except CommitFailedError as e:
+            # The group rebalanced while the batch was written; the new owner
+            # re-reads these records, which the idempotent writes tolerate.
+            logger.warning("Offset commit failed after rebalance: %s", e)
+        if self.producer is not None:
+            for contact in contacts:
+                self.producer.send(CONNECTIONS_TOPIC, contact)
+
+    def flush(self):
+        """Write everything polled so far and commit its offsets."""
+        self.hand_off(block=True)
+        while self.in_flight:
+            self.check(self.done.get())
+            self.commit_written()
+
+    def check(self, batch):
+        # A failed batch is never committed, so the worker stops and its
+        # partitions are re-read from the last commit.
+        if batch.error is not None:
+            self.error = batch.error
+            raise batch.error
+
+    def decode_loop(self):
+        while True:
+            batch = self.decode_queue.get()
+            if batch is None:
+                for write_queue in self.write_queues:
+                    write_queue.put(None)
+                return
+            try:
+                batch.messages = [message._replace(value=_deserialize(message)) for message in batch.messages]
+                batch.write = self.prepare(batch.messages)
+            except Exception as e:
+                batch.error = e
+                self.done.put(batch)
+                continue
+            self.write_queues[batch.writer].put(batch)
+
+    def write_loop(self, index):
+        while True:
+            batch = self.write_queues[index].get()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            try:
+                while True:
+                    try:
+                        batch.contacts = batch.write()
+                        break
+                    except OperationalError as e:
+                        # The detector already saw events of the rolled-back write.
+                        self.reset_detector()
+                        logger.warning(
+                            "Database unavailable, retrying batch of %d in %.0fs: %s",
+                            len(batch.messages), CONSUMER_RETRY_SECONDS, e,
+                        )
+                        time.sleep(CONSUMER_RETRY_SECONDS)
+            except Exception as e:
+                batch.error = e
+            else:
+                batch.written = True
+                seconds = time.perf_counter() - started
+                self.metrics.observe_write(len(batch.messages), seconds)
+                logger.debug(
+                    "Stored %d events and %d contacts in %.0fms", len(batch.messages), len(batch.contacts), seconds * 1000,
+                )
+            self.done.put(batch)
+
+    def prepare(self, messages):
+        """Decode-stage work for one batch; returns the callable that writes it and returns its contacts."""
+        if CONSUMER_SINK == "locations":
+            return self.prepare_locations(messages)
+        rows = [event_row(message.value) for message in messages]
+
+        def write():
+            save_batch(rows)
+            return []
+
+        return write
+
+    def prepare_locations(self, messages):
+        rows, event_rows = [], []
+        for message in messages:
+            try:
+                rows.append(location_row(message))
+            except ValueError as e:
+                event_rows.append(event_row(message.value, str(e)))
+                continue
+            if CONSUMER_AUDIT:
+                event_rows.append(event_row(message.value))
+        if event_rows and not CONSUMER_AUDIT:
+            logger.warning("Rejected %d of %d location events", len(event_rows), len(messages))
+
+        def detect(ids):
+            contacts = []
+            with self.detect_lock:
+                for location_id, row in zip(ids, rows):
+                    seconds = (row["creation_time"] - _EPOCH).total_seconds()
+                    event = Event(seconds, location_id, row["person_id"], row["latitude"], row["longitude"])
+                    contacts.extend(self.detector.add(event))
+            return contacts
+
+        def write():
+            _, contacts = save_locations(rows, event_rows, detect if self.detector is not None else None)
+            return contacts
+
+        return write
+
+    def reset_detector(self):
+        with self.detect_lock:
+            if self.detector is not None:
+                self.detector = ContactDetector(self.detector.meters, self.detector.window_seconds, self.detector.max_events)
+
+    def lag(self):
+        """Records per assigned partition between the log end and this worker's commit."""
+        partitions = list(self.consumer.assignment())
+        if not partitions:
+            return {}
+        ends = self.consumer.end_offsets(partitions)
+        lag = {}
+        for tp in partitions:
+            done = self.committed.get(tp)
+            if done is None:
+                done = self.consumer.position(tp)
+            lag[(tp.topic, tp.partition)] = max(0, ends[tp] - done)
+        return lag
+
+    def report_metrics(self):
+        if self.report is None or time.monotonic() - self.reported_at < CONSUMER_METRICS_SECONDS:
+            return
+        self.reported_at = time.monotonic()
+        try:
+            self.metrics.lag = self.lag()
+        except KafkaError as e:
+            logger.warning("Could not read partition end offsets: %s", e)
+        self.report(self.metrics.snapshot())
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            if not self.held:
+                self.poll_batch()
+            else:
+                # Paused: keep polling so the group still sees this member alive.
+                records = self.consumer.poll(timeout_ms=CONSUMER_LINGER_MS)
+                for partition_records in records.values():
+                    self.pending.extend(partition_records)
+            if self.error is not None:
+                # Raised inside a rebalance callback, which poll() swallows.
+                raise self.error
+            self.hand_off()
+            self.commit_written()
+            self.report_metrics()
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.decode_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.consumer.close(autocommit=False)
+        if self.producer is not None:
+            self.producer.flush()
+            self.producer.close()
+
+
+def _new_consumer():
+    return KafkaConsumer(
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        group_id=CONSUMER_GROUP_ID,
+        enable_auto_commit=False,
+        auto_offset_reset=CONSUMER_AUTO_OFFSET_RESET,
+        max_poll_records=CONSUMER_BATCH_SIZE,
+    )
+
+
+def run_worker(name="consumer", reports=None):
+    consumer = _new_consumer()
+    detector = None
+    if CONTACT_DETECTION and CONSUMER_SINK == "locations":
+        detector = ContactDetector()
+    elif CONTACT_DETECTION:
+        logger.info("Contact detection needs CONSUMER_SINK=locations; it is off for the %s sink", CONSUMER_SINK)
+    producer = None
+    if detector is not None and CONNECTIONS_TOPIC:
+        producer = KafkaProducer(
+            bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+            value_serializer=lambda v: json.dumps(v, default=lambda o: o.isoformat()).encode('utf-8')
+        )
+    worker = Worker(consumer, detector, producer, reports.put if reports is not None else metrics.report, name)
+    consumer.subscribe([LOCATIONS_TOPIC], listener=_FlushOnRevoke(worker))
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+def worker_count():
+    if CONSUMER_WORKERS != "auto":
+        return max(1, int(CONSUMER_WORKERS))
+    consumer = KafkaConsumer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
+    try:
+        return max(1, len(consumer.partitions_for_topic(LOCATIONS_TOPIC) or ()))
+    finally:
+        consumer.close()
+
+
+def _collect_reports(reports):
+    while True:
+        metrics.report(reports.get())
+
+
+def main():
+    migrate.upgrade(engine)
+    # The parent never touches the database again.
+    engine.dispose()
+    http = threading.Thread(target=controller.serve, name="http", daemon=True)
+    count = worker_count()
+    if count == 1:
+        http.start()
+        run_worker("consumer-0")
+        return
+    # Workers are spawned, not forked: the parent runs the HTTP and report
+    # threads, and a forked child could inherit a lock one of them holds.
+    spawn = multiprocessing.get_context("spawn")
+    reports = spawn.Queue()
+    stopping = False
+
+    def stop(*args):
+        nonlocal stopping
+        stopping = True
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+
+    def start(index):
+        process = spawn.Process(target=run_worker, args=(f"consumer-{index}", reports), name=f"consumer-{index}")
+        process.start()
+        return process
+
+    logger.info("Starting %d consumer workers", count)
+    workers = [start(index) for index in range(count)]
+    threading.Thread(target=_collect_reports, args=(reports,), name="reports", daemon=True).start()
+    http.start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopping:
+        for index, process in enumerate(workers):
+            if not process.is_alive() and not stopping:
+                logger.warning("Worker %s exited with %s, restarting", process.name, process.exitcode)
+                time.sleep(CONSUMER_RESTART_SECONDS)
+                workers[index] = start(index)
+        time.sleep(1)
+    for process in workers:
+        process.join()
 
-consumer = KafkaConsumer(
-    'locations',
-    bootstrap_servers='kafka:9092',
-    value_deserializer=lambda m: json.loads(m.decode('utf-8'))
-)
 
-for message in consumer:
-    save_kafka_event(message.value)
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,34 @@
+import os
 from flask import Blueprint
-from flask import Flask
+from flask import Flask, Response
+import metrics
 app = Flask(__name__)
 bp = Blueprint("kafka_consumer", __name__)
 
+# Port of the health and metrics endpoints served next to the consumer.
+CONSUMER_HTTP_PORT = int(os.environ.get("CONSUMER_HTTP_PORT", "5000"))
+
 @bp.route("/healthz", methods=["GET"])
 def health_check():
     return {"status": "kafka-consumer healthy"}, 200
+
+@bp.route("/readyz", methods=["GET"])
+def ready_check():
+    lag = metrics.total_lag()
+    if lag is None:
+        return {"status": "starting"}, 503
+    if lag > metrics.CONSUMER_READY_MAX_LAG:
+        return {"status": "lagging", "lag": lag, "max_lag": metrics.CONSUMER_READY_MAX_LAG}, 503
+    return {"status": "ready", "lag": lag}, 200
+
+@bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+app.register_blueprint(bp)
+
+def serve():
+    app.run(host="0.0.0.0", port=CONSUMER_HTTP_PORT, use_reloader=False)
+
 if __name__ == "__main__":
-    app.register_blueprint(bp)
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    serve()
@@ -0,0 +1,112 @@
+"""
+Streaming contact detection.
+
+Keeps the location events of the last ``window`` seconds in an in-memory grid
+of ``meters``-sized cells. Every new event is compared only with the events
+in its neighbouring cells, and pairs of different persons within ``meters``
+and ``window`` of each other are returned straight away as contacts.
+Events older than the window (relative to the newest event seen) are expired
+in arrival order, so memory stays proportional to the event rate.
+
+Every event carries the id of its stored ``location`` row, which the
+contact rows reference, so the consumer only detects with CONSUMER_SINK=locations.
+"""
+import math
+import os
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+
+EARTH_RADIUS_METERS = 6371008.8
+# Meters per degree of latitude on the sphere haversine() measures on; a
+# larger value would size search windows smaller than the radius.
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_METERS / 360.0
+
+CONTACT_METERS = float(os.environ.get("CONTACT_METERS", "50"))
+CONTACT_WINDOW_MINUTES = float(os.environ.get("CONTACT_WINDOW_MINUTES", "10"))
+# Hard cap on events held in the window, oldest dropped first.
+MAX_WINDOW_EVENTS = int(os.environ.get("CONTACT_MAX_WINDOW_EVENTS", "1000000"))
+
+Event = namedtuple("Event", ["seconds", "location_id", "person_id", "latitude", "longitude"])
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two coordinates."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def contact_row(a, b):
+    """Connection row for a contact, smaller location id first, at the later event's time."""
+    if a.location_id > b.location_id:
+        a, b = b, a
+    return {
+        "person_id": a.person_id,
+        "location_id": a.location_id,
+        "contact_person_id": b.person_id,
+        "contact_location_id": b.location_id,
+        "creation_time": datetime.fromtimestamp(max(a.seconds, b.seconds), timezone.utc).replace(tzinfo=None),
+    }
+
+
+class ContactDetector:
+
+    def __init__(self, meters=CONTACT_METERS, window_seconds=CONTACT_WINDOW_MINUTES * 60, max_events=MAX_WINDOW_EVENTS):
+        self.meters = meters
+        self.window_seconds = window_seconds
+        self.max_events = max_events
+        self.cell_degrees = meters / METERS_PER_DEGREE
+        self.watermark = float("-inf")
+        self._cells = {}
+        self._arrivals = deque()
+
+    def __len__(self):
+        return len(self._arrivals)
+
+    def _cell(self, latitude, longitude):
+        return (
+            int(math.floor((latitude + 90.0) / self.cell_degrees)),
+            int(math.floor((longitude + 180.0) / self.cell_degrees)),
+        )
+
+    def _neighbours(self, latitude, longitude):
+        row, col = self._cell(latitude, longitude)
+        # Cells are square in degrees, so away from the equator a radius of
+        # `meters` spans more than one column.
+        cos_lat = math.cos(math.radians(min(abs(latitude) + self.cell_degrees, 89.9)))
+        span = int(math.ceil(1.0 / cos_lat))
+        for r in (row - 1, row, row + 1):
+            for c in range(col - span, col + span + 1):
+                events = self._cells.get((r, c))
+                if events:
+                    yield from events
+
+    def _expire(self):
+        horizon = self.watermark - self.window_seconds
+        while self._arrivals and (self._arrivals[0].seconds < horizon or len(self._arrivals) > self.max_events):
+            event = self._arrivals.popleft()
+            cell = self._cell(event.latitude, event.longitude)
+            events = self._cells[cell]
+            events.popleft()
+            if not events:
+                del self._cells[cell]
+
+    def add(self, event):
+        """Index `event` and return the contact rows it forms with events in the window."""
+        self.watermark = max(self.watermark, event.seconds)
+        self._expire()
+        contacts = []
+        for other in self._neighbours(event.latitude, event.longitude):
+            if other.person_id == event.person_id or other.location_id == event.location_id:
+                continue
+            if abs(other.seconds - event.seconds) > self.window_seconds:
+                continue
+            if haversine(event.latitude, event.longitude, other.latitude, other.longitude) <= self.meters:
+                contacts.append(contact_row(event, other))
+        if event.seconds >= self.watermark - self.window_seconds:
+            self._arrivals.append(event)
+            self._cells.setdefault(self._cell(event.latitude, event.longitude), deque()).append(event)
+        return contacts
@@ -0,0 +1,146 @@
+"""
+Consumer metrics in the Prometheus text format.
+
+Each worker keeps a WorkerMetrics and periodically reports a snapshot of
+it; worker processes send theirs to the supervisor over a queue. The
+supervisor keeps the latest snapshot per worker and serves them from the
+HTTP endpoints in controller.py, labelled by worker.
+"""
+import bisect
+import os
+import threading
+import time
+
+# Readiness fails while the summed lag of this container's partitions is above this.
+CONSUMER_READY_MAX_LAG = int(os.environ.get("CONSUMER_READY_MAX_LAG", "10000"))
+
+BATCH_SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+WRITE_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {"buckets": self.buckets, "counts": list(self.counts), "sum": self.sum}
+
+
+class WorkerMetrics:
+    """Counters of one worker; the writer threads and the poll thread update it."""
+
+    def __init__(self, name):
+        self.name = name
+        self.records = 0
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.write_seconds = Histogram(WRITE_SECONDS_BUCKETS)
+        self.last_commit = None
+        self.lag = {}
+        self.paused = False
+        self._rate = (time.monotonic(), 0)
+        self._lock = threading.Lock()
+
+    def observe_write(self, records, seconds):
+        with self._lock:
+            self.records += records
+            self.batch_sizes.observe(records)
+            self.write_seconds.observe(seconds)
+
+    def observe_commit(self):
+        self.last_commit = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            then, records = self._rate
+            self._rate = (now, self.records)
+            return {
+                "worker": self.name,
+                "records": self.records,
+                "records_per_second": (self.records - records) / max(now - then, 1e-9),
+                "batch_sizes": self.batch_sizes.snapshot(),
+                "write_seconds": self.write_seconds.snapshot(),
+                "last_commit": self.last_commit,
+                "lag": dict(self.lag),
+                "paused": self.paused,
+            }
+
+
+_reports = {}
+_reports_lock = threading.Lock()
+
+
+def report(snapshot):
+    with _reports_lock:
+        _reports[snapshot["worker"]] = snapshot
+
+
+def total_lag():
+    """Summed lag over every worker's partitions, or None before the first report."""
+    with _reports_lock:
+        if not _reports:
+            return None
+        return sum(sum(snapshot["lag"].values()) for snapshot in _reports.values())
+
+
+def _histogram_lines(name, worker, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram["buckets"] + ("+Inf",), histogram["counts"]):
+        cumulative += count
+        yield f'{name}_bucket{{worker="{worker}",le="{bound}"}} {cumulative}'
+    yield f'{name}_sum{{worker="{worker}"}} {histogram["sum"]}'
+    yield f'{name}_count{{worker="{worker}"}} {cumulative}'
+
+
+def render():
+    with _reports_lock:
+        snapshots = sorted(_reports.values(), key=lambda snapshot: snapshot["worker"])
+    lines = [
+        "# HELP consumer_lag_records Records in the partition not yet committed by the group.",
+        "# TYPE consumer_lag_records gauge",
+    ]
+    for snapshot in snapshots:
+        for (topic, partition), lag in sorted(snapshot["lag"].items()):
+            lines.append(f'consumer_lag_records{{worker="{snapshot["worker"]}",topic="{topic}",partition="{partition}"}} {lag}')
+    lines += [
+        "# HELP consumer_records_total Records written to the database.",
+        "# TYPE consumer_records_total counter",
+    ]
+    lines += [f'consumer_records_total{{worker="{s["worker"]}"}} {s["records"]}' for s in snapshots]
+    lines += [
+        "# HELP consumer_records_per_second Records written per second since the previous report.",
+        "# TYPE consumer_records_per_second gauge",
+    ]
+    lines += [f'consumer_records_per_second{{worker="{s["worker"]}"}} {s["records_per_second"]:.3f}' for s in snapshots]
+    lines += [
+        "# HELP consumer_batch_size_records Records per written batch.",
+        "# TYPE consumer_batch_size_records histogram",
+    ]
+    for snapshot in snapshots:
+        lines += _histogram_lines("consumer_batch_size_records", snapshot["worker"], snapshot["batch_sizes"])
+    lines += [
+        "# HELP consumer_write_seconds Time to write one batch, including retries.",
+        "# TYPE consumer_write_seconds histogram",
+    ]
+    for snapshot in snapshots:
+        lines += _histogram_lines("consumer_write_seconds", snapshot["worker"], snapshot["write_seconds"])
+    lines += [
+        "# HELP consumer_last_commit_timestamp_seconds Unix time of the last offset commit.",
+        "# TYPE consumer_last_commit_timestamp_seconds gauge",
+    ]
+    lines += [
+        f'consumer_last_commit_timestamp_seconds{{worker="{s["worker"]}"}} {s["last_commit"]}'
+        for s in snapshots if s["last_commit"] is not None
+    ]
+    lines += [
+        "# HELP consumer_paused Whether the worker paused its partitions because its pipeline is full.",
+        "# TYPE consumer_paused gauge",
+    ]
+    lines += [f'consumer_paused{{worker="{s["worker"]}"}} {int(s["paused"])}' for s in snapshots]
+    return "\n".join(lines) + "\n"
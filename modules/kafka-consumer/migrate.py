@@ -0,0 +1,22 @@
+"""
+Schema setup for the kafka_events table.
+
+``Base.metadata.create_all`` only creates tables that do not exist yet, so
+columns added to an existing deployment are applied here.
+"""
+from sqlalchemy import text
+from database import Base
+
+UPGRADES = [
+    "ALTER TABLE kafka_events ADD COLUMN IF NOT EXISTS data JSONB",
+    "ALTER TABLE kafka_events ADD COLUMN IF NOT EXISTS error VARCHAR",
+]
+
+
+def upgrade(engine):
+    Base.metadata.create_all(bind=engine)
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for statement in UPGRADES:
+            conn.execute(text(statement))
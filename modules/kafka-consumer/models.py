@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from database import Base
 
@@ -6,5 +8,38 @@ class KafkaEvent(Base):
     __tablename__ = "kafka_events"
 
     id = Column(Integer, primary_key=True)
+    # Message text, kept only when it is not valid JSON.
     payload = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # Parsed message, queryable and indexable as JSONB in Postgres.
+    data = Column(JSON().with_variant(JSONB(), "postgresql"))
+    # Why the locations sink rejected the message, if it did.
+    error = Column(String)
+
+
+# Tables owned by the connections and locations services; mapped on their
+# own bases so this service never creates or alters them.
+ConnectionsBase = declarative_base()
+
+class Connection(ConnectionsBase):
+    __tablename__ = "connections"
+
+    id = Column(Integer, primary_key=True)
+    person_id = Column(Integer, nullable=False)
+    location_id = Column(Integer, nullable=False)
+    creation_time = Column(DateTime, default=datetime.utcnow)
+    contact_person_id = Column(Integer)
+    contact_location_id = Column(Integer)
+
+
+LocationBase = declarative_base()
+
+class Location(LocationBase):
+    __tablename__ = "location"
+
+    id = Column(Integer, primary_key=True)
+    person_id = Column(Integer, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    grid_cell = Column(BigInteger)
+    creation_time = Column(DateTime, nullable=False)
@@ -0,0 +1,18 @@
+from datetime import datetime, timezone
+from typing import Optional
+from pydantic import BaseModel, Field, field_validator
+
+class LocationEvent(BaseModel):
+    person_id: int
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    # Falls back to the Kafka record timestamp when absent.
+    creation_time: Optional[datetime] = None
+
+    @field_validator("creation_time")
+    @classmethod
+    def naive_utc(cls, value):
+        # The column stores naive UTC timestamps.
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
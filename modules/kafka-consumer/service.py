@@ -1,9 +1,51 @@
-from models import KafkaEvent
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from models import Connection, KafkaEvent, Location
 from database import SessionLocal
 
-def save_kafka_event(payload):
+
+def event_row(value, error=None):
+    """kafka_events row for a consumed message value."""
+    if isinstance(value, (dict, list)):
+        return {"data": value, "error": error}
+    return {"payload": value, "error": error}
+
+
+def _insert_contacts(db, contacts):
+    # Pairs already stored are skipped, so a replayed batch adds nothing.
+    if contacts:
+        dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+        db.execute(dialect.insert(Connection).on_conflict_do_nothing(), contacts)
+
+
+def save_batch(event_rows):
+    """Store kafka_events rows in one transaction."""
+    db = SessionLocal()
+    try:
+        if event_rows:
+            db.execute(insert(KafkaEvent), event_rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+def save_locations(location_rows, event_rows, detect=None):
+    """Insert location rows, audit/rejected kafka_events rows and detected contacts in one transaction.
+
+    `detect` is called with the new location ids, in row order, before the
+    commit. Returns ``(ids, contacts)``.
+    """
     db = SessionLocal()
-    event = KafkaEvent(payload=str(payload))
-    db.add(event)
-    db.commit()
-    db.close()
+    try:
+        ids = []
+        if location_rows:
+            statement = insert(Location).returning(Location.id, sort_by_parameter_order=True)
+            ids = db.execute(statement, location_rows).scalars().all()
+        if event_rows:
+            db.execute(insert(KafkaEvent), event_rows)
+        contacts = detect(ids) if detect is not None else []
+        _insert_contacts(db, contacts)
+        db.commit()
+        return ids, contacts
+    finally:
+        db.close()
@@ -0,0 +1,21 @@
+"""
+Grid cell ids shared with the locations service.
+
+Locations written by the consumer sink carry the same ``grid_cell`` the
+locations service assigns, so its proximity queries find them. The cell size
+(LOCATION_GRID_CELL_DEGREES) must match the locations service setting.
+"""
+import math
+import os
+
+# Cell edge in degrees; 0.01 degrees is roughly 1.1 km of latitude.
+CELL_DEGREES = float(os.environ.get("LOCATION_GRID_CELL_DEGREES", "0.01"))
+
+COLUMNS = int(math.ceil(360.0 / CELL_DEGREES))
+
+
+def cell_for(latitude, longitude):
+    """Return the grid cell id of a coordinate."""
+    row = int(math.floor((latitude + 90.0) / CELL_DEGREES))
+    col = int(math.floor((longitude + 180.0) / CELL_DEGREES)) % COLUMNS
+    return row * COLUMNS + col
@@ -1,17 +1,101 @@
+import json
+import os
+import signal
+import sys
 from flask import Blueprint, request, jsonify
-from producer import publish_to_kafka
+from kafka.errors import KafkaTimeoutError
+from producer import Backpressure, PRODUCER_ASYNC, get_stats, publish_many, publish_to_kafka
 from flask import Flask
 app = Flask(__name__)
 bp = Blueprint('kafka_producer', __name__)
 
+# Largest number of records accepted by one POST /produce/locations.
+PRODUCE_BATCH_MAX_RECORDS = int(os.environ.get('PRODUCE_BATCH_MAX_RECORDS', '10000'))
+# NDJSON body types; the same list as the persons, locations and connections services.
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonlines', 'application/jsonl')
+# Integer fields of a location event; LocationEvent (location_event.proto) stores them as int64.
+INT64_FIELDS = ('person_id', 'id')
+
+def _person_key(message):
+    # Keyed by person so each person's locations stay ordered on one partition.
+    # This does not keep contacts on one consumer worker: two persons in
+    # contact usually hash to different partitions, and those pairs are only
+    # found by the batch contact job in the connections service.
+    return message.get('person_id') if isinstance(message, dict) else None
+
+def _check_record(record, name='record'):
+    """Raise ValueError if `record` is not a JSON object or an id lies outside the int64 range."""
+    if not isinstance(record, dict):
+        raise ValueError(f'{name} is not a JSON object')
+    for field in INT64_FIELDS:
+        value = record.get(field)
+        if isinstance(value, int) and not -2**63 <= value < 2**63:
+            raise ValueError(f'{name} has {field} outside the int64 range')
+
+def _read_records():
+    """Records of a JSON array body, or of an NDJSON body with one object per line."""
+    if request.mimetype in NDJSON_MIMETYPES:
+        records = []
+        for number, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                raise ValueError(f'line {number} is not valid JSON')
+            if len(records) > PRODUCE_BATCH_MAX_RECORDS:
+                break
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            raise ValueError('expected a JSON array or an NDJSON body')
+    for number, record in enumerate(records, 1):
+        _check_record(record, f'record {number}')
+    return records
+
 @bp.route('/produce/location', methods=['POST'])
 def produce_location():
     data = request.get_json()
+    if isinstance(data, dict):
+        try:
+            _check_record(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    try:
+        publish_to_kafka('locations', data, key=_person_key(data))
+    except (Backpressure, KafkaTimeoutError) as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if PRODUCER_ASYNC:
+        return jsonify({'status': 'Message accepted'}), 202
+    return jsonify({'status': 'Message published'}), 200
+
+@bp.route('/produce/locations', methods=['POST'])
+def produce_locations():
     try:
-        publish_to_kafka('locations', data)
-        return jsonify({'status': 'Message published'}), 200
+        records = _read_records()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(records) > PRODUCE_BATCH_MAX_RECORDS:
+        return jsonify({'error': f'at most {PRODUCE_BATCH_MAX_RECORDS} records per request'}), 413
+    try:
+        publish_many('locations', records, key=_person_key)
+    except Backpressure as e:
+        return jsonify({'error': str(e), 'received': len(records), 'published': e.published}), 503, {'Retry-After': '1'}
+    except KafkaTimeoutError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    if PRODUCER_ASYNC:
+        return jsonify({'status': 'Messages accepted', 'received': len(records)}), 202
+    return jsonify({'status': 'Messages published', 'received': len(records)}), 200
+
+@bp.route('/produce/stats', methods=['GET'])
+def produce_stats():
+    return jsonify(get_stats()), 200
 if __name__ == "__main__":
+    # Exit through atexit so buffered records are delivered before shutdown.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
     app.register_blueprint(bp)
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=5000)
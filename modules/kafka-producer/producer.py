@@ -1,21 +1,136 @@
+"""
+Kafka producer shared by the HTTP endpoints.
+
+Sends are never flushed one by one: the client batches records per
+partition for up to PRODUCER_LINGER_MS and delivers them in the background.
+In the default mode a request still waits for its own record to be
+acknowledged; with PRODUCER_ASYNC=1 it returns as soon as the record is
+buffered and failures are only logged. At most PRODUCER_MAX_IN_FLIGHT
+records are buffered at a time; past that, publishing waits up to
+PRODUCER_ENQUEUE_TIMEOUT_SECONDS and then raises Backpressure.
+"""
+import atexit
+import logging
+import os
+import threading
 from kafka import KafkaProducer
-import json
-import time
+import wire
+
+logger = logging.getLogger(__name__)
+
+KAFKA_BOOTSTRAP_SERVERS = os.environ.get("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
+# Return once the record is buffered instead of once the broker acknowledged it.
+PRODUCER_ASYNC = os.environ.get("PRODUCER_ASYNC", "0") == "1"
+# How long the client waits to fill a batch, and its size in bytes per partition.
+PRODUCER_LINGER_MS = int(os.environ.get("PRODUCER_LINGER_MS", "5"))
+PRODUCER_BATCH_SIZE = int(os.environ.get("PRODUCER_BATCH_SIZE", "65536"))
+# gzip, snappy, lz4 or zstd; empty for none. All but gzip need their Python codec installed.
+PRODUCER_COMPRESSION = os.environ.get("PRODUCER_COMPRESSION", "") or None
+# Records buffered or awaiting acknowledgement before publishing pushes back.
+PRODUCER_MAX_IN_FLIGHT = int(os.environ.get("PRODUCER_MAX_IN_FLIGHT", "10000"))
+PRODUCER_ENQUEUE_TIMEOUT_SECONDS = float(os.environ.get("PRODUCER_ENQUEUE_TIMEOUT_SECONDS", "1"))
+# Longest a synchronous publish waits for the broker.
+PRODUCER_SEND_TIMEOUT_SECONDS = float(os.environ.get("PRODUCER_SEND_TIMEOUT_SECONDS", "10"))
+# "json", or "protobuf" for LocationEvent records; see wire.py. Consumers
+# must be upgraded to read protobuf before producers start writing it.
+PRODUCER_WIRE_FORMAT = os.environ.get("PRODUCER_WIRE_FORMAT", "json")
+
+
+class Backpressure(Exception):
+    """Too many records are in flight; the caller should retry later."""
+
 
 producer = KafkaProducer(
-    bootstrap_servers='kafka:9092',
-    value_serializer=lambda v: json.dumps(v).encode('utf-8')
+    bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+    key_serializer=lambda k: None if k is None else str(k).encode('utf-8'),
+    linger_ms=PRODUCER_LINGER_MS,
+    batch_size=PRODUCER_BATCH_SIZE,
+    compression_type=PRODUCER_COMPRESSION,
 )
 
-def publish_to_kafka(topic, message):
-    retry = 3
-    while retry > 0:
-        try:
-            producer.send(topic, message)
-            producer.flush()
-            break
-        except Exception as e:
-            retry -= 1
-            time.sleep(1)
-            if retry == 0:
-                raise e
+_in_flight = threading.BoundedSemaphore(PRODUCER_MAX_IN_FLIGHT)
+_counts = {"in_flight": 0, "failed": 0}
+_counts_lock = threading.Lock()
+
+
+def _release(failed=False):
+    with _counts_lock:
+        _counts["in_flight"] -= 1
+        _counts["failed"] += failed
+    _in_flight.release()
+
+
+def _delivered(metadata):
+    _release()
+
+
+def _failed(error):
+    _release(failed=True)
+    logger.error("Kafka delivery failed: %s", error)
+
+
+def _send(topic, message, key):
+    if not _in_flight.acquire(timeout=PRODUCER_ENQUEUE_TIMEOUT_SECONDS):
+        raise Backpressure(f"{PRODUCER_MAX_IN_FLIGHT} records already in flight")
+    with _counts_lock:
+        _counts["in_flight"] += 1
+    try:
+        value, headers = wire.encode(message, PRODUCER_WIRE_FORMAT)
+        future = producer.send(topic, value, key=key, headers=headers)
+    except Exception:
+        _release(failed=True)
+        raise
+    future.add_callback(_delivered)
+    future.add_errback(_failed)
+    return future
+
+
+def publish_to_kafka(topic, message, key=None):
+    """Buffer one record for `topic`; waits for its acknowledgement unless PRODUCER_ASYNC is set.
+
+    Records with the same `key` go to the same partition, in order.
+    Raises Backpressure when the in-flight buffer stays full.
+    """
+    future = _send(topic, message, key)
+    if not PRODUCER_ASYNC:
+        future.get(timeout=PRODUCER_SEND_TIMEOUT_SECONDS)
+    return future
+
+
+def publish_many(topic, messages, key=None):
+    """Buffer every message, then wait for all acknowledgements unless PRODUCER_ASYNC is set.
+
+    `key` maps a message to its record key. On Backpressure the records
+    before the failing one are already buffered; the exception's
+    ``published`` attribute counts them.
+    """
+    futures = []
+    try:
+        for message in messages:
+            futures.append(_send(topic, message, key(message) if key is not None else None))
+    except Backpressure as e:
+        e.published = len(futures)
+        raise
+    if not PRODUCER_ASYNC:
+        for future in futures:
+            future.get(timeout=PRODUCER_SEND_TIMEOUT_SECONDS)
+    return futures
+
+
+def get_stats():
+    return {
+        "async": PRODUCER_ASYNC,
+        "wire_format": PRODUCER_WIRE_FORMAT,
+        "in_flight": _counts["in_flight"],
+        "max_in_flight": PRODUCER_MAX_IN_FLIGHT,
+        "failed": _counts["failed"],
+    }
+
+
+def close():
+    """Deliver everything still buffered; called once on shutdown."""
+    producer.flush()
+    producer.close()
+
+
+atexit.register(close)
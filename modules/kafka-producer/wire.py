@@ -0,0 +1,91 @@
+"""
+Wire formats of records on the locations topic.
+
+A record's ``content-type`` header names its format: ``application/json``,
+or ``application/x-protobuf`` with the ``schema`` parameter naming the
+LocationEvent version (location_event.proto). Records without the header
+are JSON, as every record was before the header existed. Messages that do
+not fit the protobuf schema (missing or extra fields, unparsable times) are
+sent as JSON, so the consumer still sees and records them unchanged.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from google.protobuf.message import DecodeError
+from location_event_pb2 import LocationEvent
+
+CONTENT_TYPE = "content-type"
+JSON = b"application/json"
+PROTOBUF = b"application/x-protobuf; schema=udaconnect.locations.v1.LocationEvent"
+
+_FIELDS = {"id", "person_id", "latitude", "longitude", "creation_time"}
+_INT64_MIN, _INT64_MAX = -2**63, 2**63 - 1
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+
+
+def _is_int(value):
+    """True for an int that fits the int64 fields of LocationEvent."""
+    return isinstance(value, int) and not isinstance(value, bool) and _INT64_MIN <= value <= _INT64_MAX
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _to_protobuf(message):
+    """LocationEvent for a message dict, or None if protobuf cannot carry it losslessly."""
+    if not isinstance(message, dict) or not message.keys() <= _FIELDS:
+        return None
+    if not _is_int(message.get("person_id")):
+        return None
+    if not (_is_number(message.get("latitude")) and _is_number(message.get("longitude"))):
+        return None
+    event = LocationEvent(person_id=message["person_id"], latitude=message["latitude"], longitude=message["longitude"])
+    if message.get("id") is not None:
+        if not _is_int(message["id"]):
+            return None
+        event.id = message["id"]
+    if message.get("creation_time") is not None:
+        try:
+            creation_time = datetime.fromisoformat(message["creation_time"])
+        except (TypeError, ValueError):
+            return None
+        if creation_time.tzinfo is None:
+            creation_time = creation_time.replace(tzinfo=timezone.utc)
+        delta = creation_time - _EPOCH
+        event.creation_time_us = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return event
+
+
+def _from_protobuf(event):
+    message = {"person_id": event.person_id, "latitude": event.latitude, "longitude": event.longitude}
+    if event.HasField("id"):
+        message["id"] = event.id
+    if event.HasField("creation_time_us"):
+        message["creation_time"] = (_NAIVE_EPOCH + timedelta(microseconds=event.creation_time_us)).isoformat()
+    return message
+
+
+def encode(message, wire_format="json"):
+    """Return ``(value, headers)`` for a message; `wire_format` is "json" or "protobuf"."""
+    if wire_format == "protobuf":
+        event = _to_protobuf(message)
+        if event is not None:
+            return event.SerializeToString(), [(CONTENT_TYPE, PROTOBUF)]
+    return json.dumps(message).encode("utf-8"), [(CONTENT_TYPE, JSON)]
+
+
+def decode(value, headers=()):
+    """Parse a record value according to its headers; raises ValueError if it cannot."""
+    content_type = JSON
+    for key, header in headers or ():
+        if key == CONTENT_TYPE:
+            content_type = header
+    if content_type == PROTOBUF:
+        try:
+            return _from_protobuf(LocationEvent.FromString(value))
+        except DecodeError as e:
+            raise ValueError(f"invalid LocationEvent: {e}") from e
+    if content_type.split(b";")[0].strip() != JSON:
+        raise ValueError(f"unsupported content type {content_type.decode('utf-8', errors='replace')}")
+    return json.loads(value.decode("utf-8"))
@@ -0,0 +1,100 @@
+"""
+Latest known position of each person.
+
+A bounded LRU map of ``person_id`` -> most recent location row. Entries are
+only ever replaced by newer rows, and a person missing from the cache is
+loaded from the ``(person_id, creation_time)`` index on first read, so
+out-of-order uploads (e.g. buffered offline pings) never hide a newer row.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+MAX_PERSONS = int(os.environ.get("LOCATION_LATEST_CACHE_SIZE", "100000"))
+
+
+def _newer(row, other):
+    return (row.creation_time, row.id) > (other.creation_time, other.id)
+
+
+class LatestLocationCache:
+    def __init__(self, max_size=MAX_PERSONS):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # Newest row written for persons that are being loaded from the
+        # database, so a concurrent insert is not overwritten by the load.
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, person_ids):
+        """Return ``(found, missing)``: cached rows by person id and the ids not cached.
+
+        The missing ids must then be passed to `put_many` with the rows read for them.
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for person_id in person_ids:
+                row = self._entries.get(person_id)
+                if row is None:
+                    missing.append(person_id)
+                    self._loading.setdefault(person_id, None)
+                else:
+                    self._entries.move_to_end(person_id)
+                    found[person_id] = row
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, person_ids, rows):
+        """Store the latest rows read from the database for `person_ids`."""
+        latest = {row.person_id: row for row in rows}
+        with self._lock:
+            for person_id in person_ids:
+                written = self._loading.pop(person_id, None)
+                row = latest.get(person_id)
+                if row is None or (written is not None and _newer(written, row)):
+                    row = written
+                if row is None:
+                    continue
+                current = self._entries.get(person_id)
+                if current is None or _newer(row, current):
+                    self._entries[person_id] = row
+                self._entries.move_to_end(person_id)
+            self._evict()
+
+    def update_many(self, rows):
+        """Apply freshly written rows to persons that are already cached."""
+        with self._lock:
+            for row in rows:
+                current = self._entries.get(row.person_id)
+                if current is not None and _newer(row, current):
+                    self._entries[row.person_id] = row
+                elif row.person_id in self._loading:
+                    written = self._loading[row.person_id]
+                    if written is None or _newer(row, written):
+                        self._loading[row.person_id] = row
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,15 +1,87 @@
+import functools
+import json
+import os
+from datetime import datetime, timezone
 from flask import Flask
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, make_response, stream_with_context
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-import service, schema
+import service, schema, migrate
 from models import Base
 from database import engine, get_db
 from flasgger import Swagger
 app = Flask(__name__)
 swagger = Swagger(app)
+migrate.create_partitioned_table(engine)
 Base.metadata.create_all(bind=engine)
+migrate.upgrade(engine)
 bp = Blueprint("locations", __name__, url_prefix="/locations")
 
+BATCH_MAX_ROWS = int(os.environ.get("LOCATION_BATCH_MAX_ROWS", "10000"))
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonlines", "application/jsonl")
+PAGE_DEFAULT_LIMIT = int(os.environ.get("PAGE_DEFAULT_LIMIT", "100"))
+PAGE_MAX_LIMIT = int(os.environ.get("PAGE_MAX_LIMIT", "1000"))
+# Largest radius of GET /locations/nearby, as NEARBY_MAX_METERS is for the gRPC search.
+NEARBY_MAX_METERS = float(os.environ.get("NEARBY_MAX_METERS", "50000"))
+STREAM_LINES_PER_CHUNK = 500
+
+
+def _serialize(location):
+        data = schema.LocationRead.from_orm(location).dict()
+        data["creation_time"] = data["creation_time"].isoformat()
+        return data
+
+
+def _parse_time(value):
+        """Parse an ISO 8601 query parameter into a naive UTC datetime."""
+        if value is None:
+                return None
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+
+
+def _wants_ndjson():
+        if request.args.get("format") == "ndjson":
+                return True
+        return request.accept_mimetypes.best in NDJSON_MIMETYPES
+
+
+def _ndjson(db, rows, serialize):
+        try:
+                lines = []
+                for row in rows:
+                        lines.append(json.dumps(serialize(row)))
+                        if len(lines) >= STREAM_LINES_PER_CHUNK:
+                                yield "\n".join(lines) + "\n"
+                                lines = []
+                if lines:
+                        yield "\n".join(lines) + "\n"
+        finally:
+                db.close()
+
+
+def _conditional(view):
+        """Answer 304 Not Modified when If-None-Match holds the current table version."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+                db = next(get_db())
+                try:
+                        etag = f"{service.get_list_version(db)}-{'ndjson' if _wants_ndjson() else 'json'}"
+                finally:
+                        db.close()
+                if request.if_none_match.contains(etag):
+                        response = Response(status=304)
+                        response.set_etag(etag)
+                        return response
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                        response.set_etag(etag)
+                return response
+        return wrapper
+
+
 @bp.route("", methods=["POST"])
 def create_location():
         """
@@ -30,6 +102,10 @@ def create_location():
                             type: number
                         longitude:
                             type: number
+                        creation_time:
+                            type: string
+                            format: date-time
+                            description: Defaults to the time the location is received
         responses:
             201:
                 description: Created location
@@ -39,26 +115,287 @@ def create_location():
         db: Session = next(get_db())
         location_data = schema.LocationCreate(**request.json)
         location = service.create_location(db, location_data)
-        return jsonify(schema.LocationRead.from_orm(location).dict())
+        return jsonify(_serialize(location))
+
+@bp.route("/batch", methods=["POST"])
+def create_locations_batch():
+        """
+        Create Locations In Bulk
+        ---
+        tags:
+            - locations
+        consumes:
+            - application/json
+            - application/x-ndjson
+        parameters:
+            - in: body
+                name: body
+                required: true
+                description: JSON array of locations, or one location object per line with Content-Type application/x-ndjson
+                schema:
+                    type: array
+                    items:
+                        type: object
+                        properties:
+                            person_id:
+                                type: integer
+                            latitude:
+                                type: number
+                            longitude:
+                                type: number
+                            creation_time:
+                                type: string
+                                format: date-time
+        responses:
+            201:
+                description: Ids of the created locations, in request order
+                schema:
+                    type: object
+                    properties:
+                        ids:
+                            type: array
+                            items:
+                                type: integer
+            400:
+                description: Malformed body or invalid location
+            413:
+                description: Too many locations in one request
+        """
+        try:
+                if request.mimetype in NDJSON_MIMETYPES:
+                        items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+                else:
+                        items = request.get_json()
+        except ValueError as e:
+                return jsonify({"error": f"Malformed body: {e}"}), 400
+        if not isinstance(items, list):
+                return jsonify({"error": "Expected a JSON array or NDJSON body"}), 400
+        if len(items) > BATCH_MAX_ROWS:
+                return jsonify({"error": f"At most {BATCH_MAX_ROWS} locations per batch"}), 413
+        locations_data = []
+        for index, item in enumerate(items):
+                try:
+                        locations_data.append(schema.LocationCreate(**item))
+                except (TypeError, ValidationError) as e:
+                        return jsonify({"error": f"Invalid location at index {index}: {e}"}), 400
+        db: Session = next(get_db())
+        ids = service.create_locations(db, locations_data)
+        return jsonify({"ids": ids}), 201
 
 @bp.route("", methods=["GET"])
+@_conditional
 def list_locations():
         """
         List Locations
         ---
+        tags:
+            - locations
+        parameters:
+            - in: query
+                name: after_id
+                type: integer
+                required: false
+                description: Return only locations with a larger id (keyset pagination)
+            - in: query
+                name: limit
+                type: integer
+                required: false
+                description: Page size; enables pagination when given
+            - in: query
+                name: format
+                type: string
+                enum: [json, ndjson]
+                required: false
+                description: ndjson streams every row, one JSON object per line
+            - in: query
+                name: person_id
+                type: integer
+                required: false
+                description: Return this person's locations in time order instead
+            - in: query
+                name: start
+                type: string
+                format: date-time
+                required: false
+                description: With person_id, only locations at or after this time
+            - in: query
+                name: end
+                type: string
+                format: date-time
+                required: false
+                description: With person_id, only locations before this time
+            - in: query
+                name: order
+                type: string
+                enum: [asc, desc]
+                required: false
+                description: With person_id, oldest first (asc, the default) or newest first (desc); limit keeps the first rows in this order
+        responses:
+            200:
+                description: List of locations. Paginated responses carry X-Next-After-Id while more rows remain.
+                schema:
+                    type: array
+                    items:
+                        type: object
+        """
+        db: Session = next(get_db())
+        after_id = request.args.get("after_id", type=int)
+        limit = request.args.get("limit", type=int)
+        person_id = request.args.get("person_id", type=int)
+        if person_id is not None:
+                try:
+                        start = _parse_time(request.args.get("start"))
+                        end = _parse_time(request.args.get("end"))
+                except ValueError:
+                        return jsonify({"error": "start and end must be ISO 8601 timestamps"}), 400
+                order = request.args.get("order", "asc")
+                if order not in ("asc", "desc"):
+                        return jsonify({"error": "order must be asc or desc"}), 400
+                if limit is not None:
+                        limit = max(1, min(limit, PAGE_MAX_LIMIT))
+                locations = service.get_person_locations(db, person_id, start, end, limit, newest_first=order == "desc")
+                return jsonify([_serialize(loc) for loc in locations])
+        if _wants_ndjson():
+                rows = service.iter_locations(db, after_id or 0)
+                return Response(stream_with_context(_ndjson(db, rows, _serialize)), mimetype="application/x-ndjson")
+        if after_id is None and limit is None:
+                locations = service.get_all_locations(db)
+                return jsonify([_serialize(loc) for loc in locations])
+        limit = max(1, min(limit or PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT))
+        locations = service.get_locations_page(db, after_id or 0, limit)
+        response = jsonify([_serialize(loc) for loc in locations])
+        if len(locations) == limit:
+                response.headers["X-Next-After-Id"] = str(locations[-1].id)
+        return response
+
+@bp.route("/latest", methods=["GET"])
+def latest_locations():
+        """
+        Latest Location Of Persons
+        ---
+        tags:
+            - locations
+        parameters:
+            - in: query
+                name: person_ids
+                type: string
+                required: true
+                description: Comma separated person ids, e.g. 1,2,3
+        responses:
+            200:
+                description: The most recent location of each person that has one
+                schema:
+                    type: array
+                    items:
+                        type: object
+            400:
+                description: Missing or invalid person ids
+        """
+        try:
+                person_ids = [int(value) for value in request.args.get("person_ids", "").split(",") if value.strip()]
+        except ValueError:
+                return jsonify({"error": "person_ids must be comma separated integers"}), 400
+        if not person_ids:
+                return jsonify({"error": "person_ids is required"}), 400
+        if len(person_ids) > PAGE_MAX_LIMIT:
+                return jsonify({"error": f"At most {PAGE_MAX_LIMIT} person ids per request"}), 400
+        db: Session = next(get_db())
+        latest = service.get_latest_locations(db, list(dict.fromkeys(person_ids)))
+        results = []
+        for person_id in dict.fromkeys(person_ids):
+                if person_id in latest:
+                        data = schema.LocationRead(**latest[person_id]._asdict()).dict()
+                        data["creation_time"] = data["creation_time"].isoformat()
+                        results.append(data)
+        return jsonify(results)
+
+@bp.route("/latest/stats", methods=["GET"])
+def latest_cache_stats():
+        """
+        Latest Location Cache Statistics
+        ---
         tags:
             - locations
         responses:
             200:
-                description: List of locations
+                description: Size, hits, misses, evictions and hit rate of the latest-location cache
+                schema:
+                    type: object
+        """
+        return jsonify(service.get_latest_cache_stats())
+
+@bp.route("/nearby", methods=["GET"])
+def nearby_locations():
+        """
+        Locations Near A Point
+        ---
+        tags:
+            - locations
+        parameters:
+            - in: query
+                name: lat
+                type: number
+                required: true
+            - in: query
+                name: lon
+                type: number
+                required: true
+            - in: query
+                name: meters
+                type: number
+                required: true
+                description: Search radius, at most NEARBY_MAX_METERS (default 50000)
+            - in: query
+                name: start
+                type: string
+                format: date-time
+                required: false
+                description: Only locations at or after this time
+            - in: query
+                name: end
+                type: string
+                format: date-time
+                required: false
+                description: Only locations before this time
+            - in: query
+                name: limit
+                type: integer
+                required: false
+                description: Nearest locations returned (default PAGE_DEFAULT_LIMIT, capped by PAGE_MAX_LIMIT)
+        responses:
+            200:
+                description: Locations within the radius, nearest first
                 schema:
                     type: array
                     items:
                         type: object
+            400:
+                description: Missing or invalid query parameters
         """
+        lat = request.args.get("lat", type=float)
+        lon = request.args.get("lon", type=float)
+        meters = request.args.get("meters", type=float)
+        if lat is None or lon is None or meters is None:
+                return jsonify({"error": "lat, lon and meters are required numbers"}), 400
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or meters < 0:
+                return jsonify({"error": "lat, lon or meters out of range"}), 400
+        if meters > NEARBY_MAX_METERS:
+                return jsonify({"error": f"meters must be at most {NEARBY_MAX_METERS:g}"}), 400
+        limit = max(1, min(request.args.get("limit", PAGE_DEFAULT_LIMIT, type=int), PAGE_MAX_LIMIT))
+        try:
+                start = _parse_time(request.args.get("start"))
+                end = _parse_time(request.args.get("end"))
+        except ValueError:
+                return jsonify({"error": "start and end must be ISO 8601 timestamps"}), 400
         db: Session = next(get_db())
-        locations = service.get_all_locations(db)
-        return jsonify([schema.LocationRead.from_orm(loc).dict() for loc in locations])
+        nearby = service.get_nearby_locations(db, lat, lon, meters, start, end, limit)
+        results = []
+        for distance, row in nearby:
+                data = schema.LocationNearby(**row._asdict(), distance=distance).dict()
+                data["creation_time"] = data["creation_time"].isoformat()
+                results.append(data)
+        return jsonify(results)
+
 if __name__ == "__main__":
     app.register_blueprint(bp)
     app.run(host="0.0.0.0", port=5001)
\ No newline at end of file
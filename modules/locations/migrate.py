@@ -0,0 +1,128 @@
+"""
+Idempotent schema upgrades for the location table.
+
+``Base.metadata.create_all`` only creates tables that do not exist yet, so
+columns and indexes added to an existing deployment are applied here.
+
+With ``LOCATION_PARTITIONING=monthly`` a new deployment creates ``location``
+as a table range-partitioned by month on ``creation_time``, so queries on
+recent data only touch recent partitions. An existing unpartitioned table is
+left as it is. Running this module as a script applies the upgrades and
+creates the upcoming monthly partitions, e.g. from a cron job.
+"""
+import logging
+import os
+from datetime import date
+from sqlalchemy import inspect, text
+import spatial
+
+logger = logging.getLogger(__name__)
+
+PARTITIONING = os.environ.get("LOCATION_PARTITIONING", "").lower()
+# Monthly partitions created ahead of the current month.
+PARTITION_MONTHS_AHEAD = int(os.environ.get("LOCATION_PARTITION_MONTHS_AHEAD", "3"))
+
+UPGRADES = [
+    "ALTER TABLE location ADD COLUMN IF NOT EXISTS grid_cell BIGINT",
+    "CREATE INDEX IF NOT EXISTS ix_location_grid_cell ON location (grid_cell)",
+    # Rows written before the column existed are stamped with the upgrade time.
+    "ALTER TABLE location ADD COLUMN IF NOT EXISTS creation_time TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')",
+    "CREATE INDEX IF NOT EXISTS ix_location_person_id_creation_time ON location (person_id, creation_time)",
+]
+
+# Mirrors spatial.cell_for for rows written before the column existed.
+BACKFILL_GRID_CELL = """
+UPDATE location
+SET grid_cell = FLOOR((latitude + 90) / :cell)::bigint * :columns
+              + MOD(FLOOR((longitude + 180) / :cell)::bigint, :columns)
+WHERE grid_cell IS NULL
+"""
+
+# Postgres requires the partition key in the primary key of a partitioned table.
+CREATE_PARTITIONED_TABLE = """
+CREATE TABLE location (
+    id SERIAL,
+    person_id INTEGER NOT NULL,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    grid_cell BIGINT,
+    creation_time TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (id, creation_time)
+) PARTITION BY RANGE (creation_time)
+"""
+
+
+def _postgres(engine):
+    return engine.dialect.name == "postgresql"
+
+
+def _is_partitioned(conn):
+    return bool(conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('location')")
+    ).scalar())
+
+
+def create_partitioned_table(engine):
+    """Create ``location`` as a partitioned table when enabled and missing."""
+    if PARTITIONING != "monthly" or not _postgres(engine):
+        return
+    if inspect(engine).has_table("location"):
+        with engine.connect() as conn:
+            if not _is_partitioned(conn):
+                logger.warning("location already exists unpartitioned; LOCATION_PARTITIONING ignored")
+        return
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_PARTITIONED_TABLE))
+        conn.execute(text("CREATE TABLE location_default PARTITION OF location DEFAULT"))
+    logger.info("Created location partitioned by month")
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def ensure_month_partitions(engine, today=None):
+    """Create the partitions from last month up to PARTITION_MONTHS_AHEAD months ahead."""
+    first = _add_months((today or date.today()).replace(day=1), -1)
+    with engine.connect() as conn:
+        if not _is_partitioned(conn):
+            return
+    for offset in range(PARTITION_MONTHS_AHEAD + 2):
+        lo = _add_months(first, offset)
+        hi = _add_months(lo, 1)
+        name = f"location_y{lo.year:04d}m{lo.month:02d}"
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF location "
+                    f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+                ))
+        except Exception as e:
+            # Typically rows for this month already sit in the default partition.
+            logger.warning("Could not create partition %s: %s", name, e)
+
+
+def upgrade(engine):
+    if not _postgres(engine):
+        return
+    with engine.begin() as conn:
+        for statement in UPGRADES:
+            conn.execute(text(statement))
+        result = conn.execute(
+            text(BACKFILL_GRID_CELL),
+            {"cell": spatial.CELL_DEGREES, "columns": spatial.COLUMNS},
+        )
+        if result.rowcount:
+            logger.info("Backfilled grid_cell for %d locations", result.rowcount)
+    ensure_month_partitions(engine)
+
+
+if __name__ == "__main__":
+    from database import engine
+    from models import Base
+
+    logging.basicConfig(level=logging.INFO)
+    create_partitioned_table(engine)
+    Base.metadata.create_all(bind=engine)
+    upgrade(engine)
@@ -1,14 +1,20 @@
-from sqlalchemy import Column, Integer, Float, ForeignKey
+from datetime import datetime
+from sqlalchemy import Column, Integer, BigInteger, Float, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 class Location(Base):
     __tablename__ = "location"
+    __table_args__ = (
+        Index("ix_location_person_id_creation_time", "person_id", "creation_time"),
+    )
 
     id = Column(Integer, primary_key=True)
     person_id = Column(Integer, nullable=False)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
+    grid_cell = Column(BigInteger, index=True)
+    creation_time = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 
@@ -1,12 +1,25 @@
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field, field_validator
 
 class LocationCreate(BaseModel):
     person_id: int
     latitude: float
     longitude: float
+    creation_time: datetime = Field(default_factory=datetime.utcnow)
+
+    @field_validator("creation_time")
+    @classmethod
+    def naive_utc(cls, value: datetime) -> datetime:
+        # The column stores naive UTC timestamps.
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
 
 class LocationRead(LocationCreate):
     id: int
 
     class Config:
         from_attributes = True
+
+class LocationNearby(LocationRead):
+    distance: float
@@ -1,12 +1,222 @@
+import heapq
+import os
+import threading
+import time
 from models import Location
+from sqlalchemy import func, insert, or_, text
 from sqlalchemy.orm import Session
+import cache, spatial, versions
+
+# Rows fetched per round trip from the server-side cursor when streaming.
+STREAM_CHUNK_ROWS = int(os.environ.get("LOCATION_STREAM_CHUNK_ROWS", "1000"))
+# Rows sent to Postgres per multi-row INSERT statement.
+BATCH_CHUNK_ROWS = int(os.environ.get("LOCATION_BATCH_CHUNK_ROWS", "5000"))
+# How often the caches pick up rows written by other processes (the Kafka
+# consumer sink, other replicas), and the backlog above which they are
+# dropped and reloaded on demand instead.
+CACHE_SYNC_SECONDS = float(os.environ.get("LOCATION_CACHE_SYNC_SECONDS", "1"))
+CACHE_SYNC_MAX_ROWS = int(os.environ.get("LOCATION_CACHE_SYNC_MAX_ROWS", "100000"))
+# Ids below the highest one synced that each sync reads again, for rows whose
+# transaction committed after a later id was already seen.
+CACHE_SYNC_OVERLAP_IDS = int(os.environ.get("LOCATION_CACHE_SYNC_OVERLAP_IDS", "2000"))
+
+_cells = spatial.CellMap()
+_latest = cache.LatestLocationCache()
+_version = versions.TableVersion(Location.id)
+_sync = {"after_id": None, "at": float("-inf")}
+_sync_lock = threading.Lock()
+
+_CELL_COLUMNS = (
+    Location.id, Location.person_id, Location.latitude, Location.longitude, Location.grid_cell, Location.creation_time,
+)
+
+
+def _cell_row(location):
+    return spatial.CellRow(
+        location.id, location.person_id, location.latitude, location.longitude, location.grid_cell, location.creation_time,
+    )
+
+
+def _sync_caches(db: Session):
+    """Apply rows inserted by other writers since the last sync to the caches.
+
+    Ids are assigned at insert time, not at commit, so the last
+    CACHE_SYNC_OVERLAP_IDS ids are read again; applying a row twice is a no-op.
+    """
+    if time.monotonic() - _sync["at"] < CACHE_SYNC_SECONDS:
+        return
+    with _sync_lock:
+        if time.monotonic() - _sync["at"] < CACHE_SYNC_SECONDS:
+            return
+        if _sync["after_id"] is None:
+            # Caches load from the database on a miss, so only later rows matter.
+            _sync["after_id"] = db.query(func.max(Location.id)).scalar() or 0
+        rows = (
+            db.query(*_CELL_COLUMNS)
+            .filter(Location.id > max(0, _sync["after_id"] - CACHE_SYNC_OVERLAP_IDS))
+            .order_by(Location.id)
+            .limit(CACHE_SYNC_MAX_ROWS + CACHE_SYNC_OVERLAP_IDS + 1)
+            .all()
+        )
+        if len(rows) > CACHE_SYNC_MAX_ROWS + CACHE_SYNC_OVERLAP_IDS:
+            _cells.clear()
+            _latest.clear()
+            _sync["after_id"] = db.query(func.max(Location.id)).scalar() or 0
+        elif rows:
+            cell_rows = [spatial.CellRow(*row) for row in rows]
+            _cells.add(cell_rows)
+            _latest.update_many(cell_rows)
+            _sync["after_id"] = max(_sync["after_id"], cell_rows[-1].id)
+        _sync["at"] = time.monotonic()
+
 
 def create_location(db: Session, location_data):
     location = Location(**location_data.dict())
+    location.grid_cell = spatial.cell_for(location.latitude, location.longitude)
     db.add(location)
     db.commit()
+    _version.invalidate()
     db.refresh(location)
+    row = _cell_row(location)
+    _cells.add([row])
+    _latest.update_many([row])
     return location
 
+def create_locations(db: Session, locations_data):
+    """Insert many locations in one transaction and return their ids in input order."""
+    rows = []
+    for location_data in locations_data:
+        row = location_data.dict()
+        row["grid_cell"] = spatial.cell_for(row["latitude"], row["longitude"])
+        rows.append(row)
+    statement = insert(Location).returning(Location.id, sort_by_parameter_order=True)
+    ids = []
+    for start in range(0, len(rows), BATCH_CHUNK_ROWS):
+        ids.extend(db.execute(statement, rows[start:start + BATCH_CHUNK_ROWS]).scalars().all())
+    db.commit()
+    _version.invalidate()
+    cell_rows = [
+        spatial.CellRow(
+            location_id, row["person_id"], row["latitude"], row["longitude"], row["grid_cell"], row["creation_time"],
+        )
+        for location_id, row in zip(ids, rows)
+    ]
+    _cells.add(cell_rows)
+    _latest.update_many(cell_rows)
+    return ids
+
+def get_list_version(db: Session):
+    return _version.get(db)
+
 def get_all_locations(db: Session):
     return db.query(Location).all()
+
+def get_locations_page(db: Session, after_id: int, limit: int):
+    return (
+        db.query(Location)
+        .filter(Location.id > after_id)
+        .order_by(Location.id)
+        .limit(limit)
+        .all()
+    )
+
+def iter_locations(db: Session, after_id: int = 0):
+    """Yield locations in id order through a server-side cursor."""
+    return (
+        db.query(Location)
+        .filter(Location.id > after_id)
+        .order_by(Location.id)
+        .yield_per(STREAM_CHUNK_ROWS)
+    )
+
+def get_person_locations(db: Session, person_id: int, start=None, end=None, limit=None, newest_first=False):
+    """Locations of one person with ``start <= creation_time < end``, oldest first unless `newest_first`.
+
+    Served by the ``(person_id, creation_time)`` index, read backwards for `newest_first`.
+    """
+    query = db.query(Location).filter(Location.person_id == person_id)
+    if start is not None:
+        query = query.filter(Location.creation_time >= start)
+    if end is not None:
+        query = query.filter(Location.creation_time < end)
+    if newest_first:
+        query = query.order_by(Location.creation_time.desc(), Location.id.desc())
+    else:
+        query = query.order_by(Location.creation_time, Location.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+# One backward index probe per person on (person_id, creation_time).
+_LATEST_SQL = text("""
+SELECT l.id, l.person_id, l.latitude, l.longitude, l.grid_cell, l.creation_time
+FROM unnest(CAST(:person_ids AS integer[])) AS p(person_id)
+CROSS JOIN LATERAL (
+    SELECT * FROM location
+    WHERE location.person_id = p.person_id
+    ORDER BY creation_time DESC
+    LIMIT 1
+) AS l
+""")
+
+def get_latest_locations(db: Session, person_ids):
+    """Return the most recent location of each person that has one, keyed by person id."""
+    _sync_caches(db)
+    found, missing = _latest.get_many(person_ids)
+    if missing:
+        if db.bind.dialect.name == "postgresql":
+            rows = db.execute(_LATEST_SQL, {"person_ids": missing}).all()
+        else:
+            rows = [
+                row for row in (
+                    db.query(*_CELL_COLUMNS)
+                    .filter(Location.person_id == person_id)
+                    .order_by(Location.creation_time.desc())
+                    .first()
+                    for person_id in missing
+                ) if row is not None
+            ]
+        rows = [spatial.CellRow(*row) for row in rows]
+        _latest.put_many(missing, rows)
+        found.update((row.person_id, row) for row in rows)
+    return found
+
+def get_latest_cache_stats():
+    return _latest.stats()
+
+def get_nearby_locations(db: Session, latitude: float, longitude: float, meters: float, start=None, end=None, limit=None):
+    """Return up to `limit` ``(distance, row)`` pairs within `meters` of the point, nearest first.
+
+    `start` and `end` optionally restrict the rows to ``start <= creation_time < end``.
+    """
+    ranges = spatial.neighbour_ranges(latitude, longitude, meters)
+    if spatial.range_cells(ranges) <= spatial.MAX_MAPPED_CELLS_PER_QUERY:
+        cells = [cell for lo, hi in ranges for cell in range(lo, hi + 1)]
+        _sync_caches(db)
+        missing = _cells.missing(cells)
+        if missing:
+            rows = db.query(*_CELL_COLUMNS).filter(Location.grid_cell.in_(missing)).all()
+            _cells.fill(missing, rows)
+        # Cached cells hold every time, so the window is applied in memory.
+        candidates = [
+            row for row in _cells.rows(cells)
+            if (start is None or row.creation_time >= start) and (end is None or row.creation_time < end)
+        ]
+    else:
+        # Large radius: read the cells straight from the index as id ranges.
+        query = db.query(*_CELL_COLUMNS).filter(or_(*(Location.grid_cell.between(lo, hi) for lo, hi in ranges)))
+        if start is not None:
+            query = query.filter(Location.creation_time >= start)
+        if end is not None:
+            query = query.filter(Location.creation_time < end)
+        candidates = query.all()
+
+    nearby = []
+    for row in candidates:
+        distance = spatial.haversine(latitude, longitude, row.latitude, row.longitude)
+        if distance <= meters:
+            nearby.append((distance, row))
+    if limit is not None:
+        return heapq.nsmallest(limit, nearby, key=lambda item: item[0])
+    nearby.sort(key=lambda item: item[0])
+    return nearby
@@ -0,0 +1,148 @@
+"""
+Fixed-cell spatial grid used to index locations.
+
+Every location is assigned the id of the grid cell it falls into and the id is
+stored in the indexed ``location.grid_cell`` column. A proximity query then
+only reads the handful of cells around the query point instead of the whole
+table. Recently used cells are also kept in a bounded in-process map so hot
+areas are served without a database round trip.
+"""
+import math
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+EARTH_RADIUS_METERS = 6371008.8
+# Meters per degree of latitude on the sphere haversine() measures on; a
+# larger value would size search windows smaller than the radius.
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_METERS / 360.0
+
+# Cell edge in degrees; 0.01 degrees is roughly 1.1 km of latitude.
+CELL_DEGREES = float(os.environ.get("LOCATION_GRID_CELL_DEGREES", "0.01"))
+# Upper bound on the number of cells kept in memory.
+MAX_CACHED_CELLS = int(os.environ.get("LOCATION_GRID_MAX_CELLS", "10000"))
+# Queries touching more cells than this bypass the in-process map.
+MAX_MAPPED_CELLS_PER_QUERY = int(os.environ.get("LOCATION_GRID_MAX_QUERY_CELLS", "64"))
+
+COLUMNS = int(math.ceil(360.0 / CELL_DEGREES))
+
+CellRow = namedtuple("CellRow", ["id", "person_id", "latitude", "longitude", "grid_cell", "creation_time"])
+
+
+def cell_for(latitude, longitude):
+    """Return the grid cell id of a coordinate."""
+    row = int(math.floor((latitude + 90.0) / CELL_DEGREES))
+    col = int(math.floor((longitude + 180.0) / CELL_DEGREES)) % COLUMNS
+    return row * COLUMNS + col
+
+
+def neighbour_ranges(latitude, longitude, meters):
+    """Inclusive ``(lo, hi)`` cell id ranges that may hold a point within `meters` of the coordinate.
+
+    One range per grid row (two where the window wraps around the
+    antimeridian), merged where whole rows are contiguous, so the size of
+    the result grows with the radius and not with its area.
+    """
+    dlat = meters / METERS_PER_DEGREE
+    # Longitude degrees shrink towards the poles, so size the window for the
+    # pole-ward edge of the search area.
+    cos_lat = math.cos(math.radians(min(abs(latitude) + dlat, 89.9)))
+    dlon = min(meters / (METERS_PER_DEGREE * cos_lat), 180.0)
+
+    row_lo = int(math.floor((max(latitude - dlat, -90.0) + 90.0) / CELL_DEGREES))
+    row_hi = int(math.floor((min(latitude + dlat, 90.0) + 90.0) / CELL_DEGREES))
+    col_lo = int(math.floor((longitude - dlon + 180.0) / CELL_DEGREES))
+    col_hi = int(math.floor((longitude + dlon + 180.0) / CELL_DEGREES))
+    if col_lo >= COLUMNS:
+        # Longitude 180 is column 0 again.
+        col_lo, col_hi = col_lo - COLUMNS, col_hi - COLUMNS
+    if col_hi - col_lo + 1 >= COLUMNS:
+        spans = [(0, COLUMNS - 1)]
+    elif col_lo < 0:
+        spans = [(0, col_hi), (col_lo + COLUMNS, COLUMNS - 1)]
+    elif col_hi >= COLUMNS:
+        spans = [(0, col_hi - COLUMNS), (col_lo, COLUMNS - 1)]
+    else:
+        spans = [(col_lo, col_hi)]
+    ranges = []
+    for row in range(row_lo, row_hi + 1):
+        for lo, hi in spans:
+            lo, hi = row * COLUMNS + lo, row * COLUMNS + hi
+            if ranges and lo == ranges[-1][1] + 1:
+                ranges[-1][1] = hi
+            else:
+                ranges.append([lo, hi])
+    return [tuple(r) for r in ranges]
+
+
+def range_cells(ranges):
+    """Number of cells covered by `ranges`."""
+    return sum(hi - lo + 1 for lo, hi in ranges)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two coordinates."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class CellMap:
+    """Bounded LRU map of grid cell id -> rows stored in that cell."""
+
+    def __init__(self, max_cells=MAX_CACHED_CELLS):
+        self.max_cells = max_cells
+        self._cells = OrderedDict()
+        # Rows written while a cell is being loaded from the database; merged
+        # into the cell by `fill` so a concurrent insert is never lost.
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def missing(self, cells):
+        """Return the cells that are not loaded yet and mark them as loading."""
+        with self._lock:
+            missing = [cell for cell in cells if cell not in self._cells]
+            for cell in missing:
+                self._pending.setdefault(cell, {})
+            return missing
+
+    def fill(self, cells, rows):
+        """Store the database rows read for `cells`."""
+        loaded = {cell: {} for cell in cells}
+        for row in rows:
+            loaded[row.grid_cell][row.id] = CellRow(*row)
+        with self._lock:
+            for cell, found in loaded.items():
+                found.update(self._pending.pop(cell, {}))
+                if cell not in self._cells:
+                    self._cells[cell] = found
+                self._cells.move_to_end(cell)
+            while len(self._cells) > self.max_cells:
+                self._cells.popitem(last=False)
+
+    def add(self, rows):
+        """Record freshly inserted rows in the cells that are loaded or loading."""
+        with self._lock:
+            for row in rows:
+                if row.grid_cell in self._cells:
+                    self._cells[row.grid_cell][row.id] = row
+                elif row.grid_cell in self._pending:
+                    self._pending[row.grid_cell][row.id] = row
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+
+    def rows(self, cells):
+        """Return all rows held in `cells`, which must have been filled."""
+        found = []
+        with self._lock:
+            for cell in cells:
+                rows = self._cells.get(cell)
+                if rows is not None:
+                    self._cells.move_to_end(cell)
+                    found.extend(rows.values())
+        return found
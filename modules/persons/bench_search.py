@@ -0,0 +1,75 @@
+"""
+Benchmark of the in-memory person search index.
+
+Usage:
+    python bench_search.py [--persons 1e6] [--queries 1000] [--limit 10]
+
+Indexes ``--persons`` random names and companies and reports the build time,
+the growth in peak RSS, and the median and p99 latency of searches for
+one-, two- and four-letter prefixes and for whole words.
+"""
+import argparse
+import random
+import resource
+import string
+import time
+
+import numpy as np
+
+import search
+
+FIRST = ["Anna", "Bob", "Carla", "David", "Eva", "Frank", "Grace", "Hiro", "Ines", "Jamal", "Kofi", "Lena", "Mateo", "Nadia", "Omar", "Priya"]
+SUFFIXES = ["", "son", "sen", "berg", "ton", "ley", "ez", "ova"]
+COMPANIES = ["Corp", "Labs", "Ltd", "Group", "Health", "Logistics", "Systems", "Partners"]
+
+
+def random_word(rng):
+    return rng.choice(string.ascii_uppercase) + "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8)))
+
+
+def rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--persons", type=float, default=1e6)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    rows = [
+        (i, f"{rng.choice(FIRST)} {random_word(rng)}{rng.choice(SUFFIXES)}", f"{random_word(rng)} {rng.choice(COMPANIES)}")
+        for i in range(1, int(args.persons) + 1)
+    ]
+    before = rss_mib()
+    index = search.PrefixIndex()
+    started = time.perf_counter()
+    index._bulk_add(rows)
+    print(f"{len(index)} persons indexed in {time.perf_counter() - started:.1f}s, peak RSS +{rss_mib() - before:.0f} MiB")
+
+    samples = {
+        "1 letter": [rng.choice(string.ascii_lowercase) for _ in range(args.queries)],
+        "2 letters": ["".join(rng.choices(string.ascii_lowercase, k=2)) for _ in range(args.queries)],
+        "4 letters": [name.split()[1][:4].lower() for _, name, _ in rng.sample(rows, args.queries)],
+        "word": [company.split()[0] for _, _, company in rng.sample(rows, args.queries)],
+    }
+    for label, queries in samples.items():
+        latencies, found = [], []
+        for query in queries:
+            t = time.perf_counter()
+            found.append(len(index.search(query, args.limit)))
+            latencies.append(time.perf_counter() - t)
+        latencies = np.array(latencies) * 1e3
+        print(f"{label:>9}: p50 {np.percentile(latencies, 50):.3f}ms  p99 {np.percentile(latencies, 99):.3f}ms  "
+              f"mean results {np.mean(found):.1f}")
+
+    started = time.perf_counter()
+    for i in range(1000):
+        index.add(len(rows) + 1 + i, f"New Person{i}", "Fresh Labs")
+    print(f"single add: {(time.perf_counter() - started) * 1e3 / 1000:.3f}ms mean")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Person detail cache.
+
+A bounded LRU map of ``person_id`` -> PersonRead (or None for ids that do not
+exist) whose entries expire after a TTL. Persons are only ever created, so
+`invalidate` on create is enough to keep this process consistent; the TTL
+bounds how long other replicas can serve a stale "not found".
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MAX_PERSONS = int(os.environ.get("PERSON_CACHE_SIZE", "100000"))
+TTL_SECONDS = float(os.environ.get("PERSON_CACHE_TTL_SECONDS", "300"))
+
+
+class PersonCache:
+    def __init__(self, max_size=MAX_PERSONS, ttl=TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, person_ids):
+        """Return ``(found, missing)``: cached persons by id and the ids to load.
+
+        Ids cached as not existing are in neither.
+        """
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for person_id in person_ids:
+                entry = self._entries.get(person_id)
+                if entry is None or entry[0] < now:
+                    missing.append(person_id)
+                    continue
+                self._entries.move_to_end(person_id)
+                if entry[1] is not None:
+                    found[person_id] = entry[1]
+            self.misses += len(missing)
+            self.hits += len(person_ids) - len(missing)
+        return found, missing
+
+    def put_many(self, person_ids, persons):
+        """Store the persons loaded for `person_ids`; ids without one are cached as absent."""
+        by_id = {person.id: person for person in persons}
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for person_id in person_ids:
+                self._entries[person_id] = (expires, by_id.get(person_id))
+                self._entries.move_to_end(person_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, person_id):
+        with self._lock:
+            self._entries.pop(person_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
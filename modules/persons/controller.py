@@ -1,34 +1,136 @@
-from flask import Blueprint, request, jsonify, Flask
+import functools
+import json
+import os
+from flask import Blueprint, Response, request, jsonify, Flask, make_response, stream_with_context
 from database import get_db
 from models import Person
 from database import Base, engine
-import service, schema
+import service, schema, migrate
 from flasgger import Swagger
 
 app = Flask(__name__)
 swagger = Swagger(app)
 Base.metadata.create_all(bind=engine)
+migrate.upgrade(engine)
 bp = Blueprint('persons', __name__, url_prefix='/persons')
 
+PAGE_DEFAULT_LIMIT = int(os.environ.get("PAGE_DEFAULT_LIMIT", "100"))
+PAGE_MAX_LIMIT = int(os.environ.get("PAGE_MAX_LIMIT", "1000"))
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonlines", "application/jsonl")
+STREAM_LINES_PER_CHUNK = 500
+IDS_MAX = int(os.environ.get("PERSON_IDS_MAX", "1000"))
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 100
+
+
+def _wants_ndjson():
+        if request.args.get("format") == "ndjson":
+                return True
+        return request.accept_mimetypes.best in NDJSON_MIMETYPES
+
+
+def _ndjson(db, rows, serialize):
+        try:
+                lines = []
+                for row in rows:
+                        lines.append(json.dumps(serialize(row)))
+                        if len(lines) >= STREAM_LINES_PER_CHUNK:
+                                yield "\n".join(lines) + "\n"
+                                lines = []
+                if lines:
+                        yield "\n".join(lines) + "\n"
+        finally:
+                db.close()
+
+
+def _conditional(view):
+        """Answer 304 Not Modified when If-None-Match holds the current table version."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+                db = next(get_db())
+                try:
+                        etag = f"{service.get_list_version(db)}-{'ndjson' if _wants_ndjson() else 'json'}"
+                finally:
+                        db.close()
+                if request.if_none_match.contains(etag):
+                        response = Response(status=304)
+                        response.set_etag(etag)
+                        return response
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                        response.set_etag(etag)
+                return response
+        return wrapper
+
+
+def _serialize(p):
+        return {"id": p.id, "name": p.name, "company": p.company}
+
 
 @bp.route('', methods=['GET'])
+@_conditional
 def list_persons():
         """
         List Persons
         ---
         tags:
             - persons
+        parameters:
+            - in: query
+                name: after_id
+                type: integer
+                required: false
+                description: Return only persons with a larger id (keyset pagination)
+            - in: query
+                name: limit
+                type: integer
+                required: false
+                description: Page size; enables pagination when given
+            - in: query
+                name: format
+                type: string
+                enum: [json, ndjson]
+                required: false
+                description: ndjson streams every row, one JSON object per line
+            - in: query
+                name: ids
+                type: string
+                required: false
+                description: Comma-separated person ids; returns those that exist, in the given order
         responses:
             200:
-                description: A list of persons
+                description: A list of persons. Paginated responses carry X-Next-After-Id while more rows remain.
                 schema:
                     type: array
                     items:
                         type: object
+            400:
+                description: Malformed or too many ids
         """
         db = next(get_db())
-        persons = service.get_all_persons(db)
-        return jsonify([{"id": p.id, "name": p.name, "company": p.company} for p in persons])
+        if "ids" in request.args:
+                try:
+                        ids = [int(i) for i in request.args["ids"].split(",") if i.strip()]
+                except ValueError:
+                        return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
+                if len(ids) > IDS_MAX:
+                        return jsonify({"error": f"At most {IDS_MAX} ids per request"}), 400
+                persons = service.get_persons_by_ids(db, ids)
+                return jsonify([_serialize(persons[i]) for i in dict.fromkeys(ids) if i in persons])
+        after_id = request.args.get("after_id", type=int)
+        limit = request.args.get("limit", type=int)
+        if _wants_ndjson():
+                rows = service.iter_persons(db, after_id or 0)
+                return Response(stream_with_context(_ndjson(db, rows, _serialize)), mimetype="application/x-ndjson")
+        if after_id is None and limit is None:
+                persons = service.get_all_persons(db)
+                return jsonify([_serialize(r) for r in persons])
+        limit = max(1, min(limit or PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT))
+        persons = service.get_persons_page(db, after_id or 0, limit)
+        response = jsonify([_serialize(r) for r in persons])
+        if len(persons) == limit:
+                response.headers["X-Next-After-Id"] = str(persons[-1].id)
+        return response
 
 
 @bp.route('', methods=['POST'])
@@ -69,6 +171,90 @@ def create_person():
         return jsonify({"id": person.id, "name": person.name, "company": person.company})
 
 
+@bp.route('/search', methods=['GET'])
+def search_persons():
+        """
+        Search Persons
+        ---
+        tags:
+            - persons
+        parameters:
+            - in: query
+                name: q
+                type: string
+                required: true
+                description: Text matched against the start of the name or company (and, in Postgres, anywhere in them)
+            - in: query
+                name: limit
+                type: integer
+                required: false
+                description: Maximum number of results (default 10, at most 100)
+        responses:
+            200:
+                description: Matching persons, best match first
+                schema:
+                    type: array
+                    items:
+                        type: object
+            400:
+                description: Missing query
+        """
+        query = request.args.get("q", "")
+        if not query.strip():
+                return jsonify({"error": "q is required"}), 400
+        limit = max(1, min(request.args.get("limit", SEARCH_DEFAULT_LIMIT, type=int), SEARCH_MAX_LIMIT))
+        db = next(get_db())
+        return jsonify([_serialize(p) for p in service.search_persons(db, query, limit)])
+
+
+@bp.route('/<int:person_id>', methods=['GET'])
+def get_person(person_id):
+        """
+        Get Person
+        ---
+        tags:
+            - persons
+        parameters:
+            - in: path
+                name: person_id
+                type: integer
+                required: true
+        responses:
+            200:
+                description: The person
+                schema:
+                    type: object
+                    properties:
+                        id:
+                            type: integer
+                        name:
+                            type: string
+                        company:
+                            type: string
+            404:
+                description: No person with this id
+        """
+        db = next(get_db())
+        person = service.get_person(db, person_id)
+        if person is None:
+                return jsonify({"error": "Person not found"}), 404
+        return jsonify(_serialize(person))
+
+
+@bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+        """
+        Person Cache Statistics
+        ---
+        tags:
+            - persons
+        responses:
+            200:
+                description: Size, hits, misses and evictions of the person detail cache
+        """
+        return jsonify(service.get_cache_stats())
+
+
 if __name__ == "__main__":
         app.register_blueprint(bp)
         app.run(host="0.0.0.0", port=5000)
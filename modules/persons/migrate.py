@@ -0,0 +1,47 @@
+"""
+Idempotent schema upgrades for the person table.
+
+``Base.metadata.create_all`` only creates tables that do not exist yet, so
+indexes added to an existing deployment are applied here.
+
+Search uses two kinds of expression index on ``lower(name)`` and
+``lower(company)``: B-tree indexes in the "C" collation, which serve prefix
+LIKE matches already in result order, and, when the ``pg_trgm`` extension
+can be created, GiST trigram indexes for substring matches ranked by
+similarity.
+"""
+import logging
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+UPGRADES = [
+    'CREATE INDEX IF NOT EXISTS ix_person_name_prefix ON person ((lower(name) COLLATE "C"))',
+    'CREATE INDEX IF NOT EXISTS ix_person_company_prefix ON person ((lower(company) COLLATE "C"))',
+]
+
+TRIGRAM_UPGRADES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_person_name_trgm ON person USING gist (lower(name) gist_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_person_company_trgm ON person USING gist (lower(company) gist_trgm_ops)",
+]
+
+
+def has_trigram(conn):
+    return conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar() is not None
+
+
+def upgrade(engine):
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for statement in UPGRADES:
+            conn.execute(text(statement))
+        try:
+            with conn.begin_nested():
+                for statement in TRIGRAM_UPGRADES:
+                    conn.execute(text(statement))
+        except DBAPIError as e:
+            # Creating an extension needs extra privileges on managed databases.
+            logger.warning("pg_trgm unavailable, substring search disabled in Postgres: %s", e)
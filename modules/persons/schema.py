@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class PersonCreate(BaseModel):
     name: str
@@ -6,6 +7,8 @@ class PersonCreate(BaseModel):
 
 class PersonRead(PersonCreate):
     id: int
+    # The column is nullable, and rows created outside the API may leave it empty.
+    company: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -0,0 +1,123 @@
+"""
+In-memory prefix index over person name and company.
+
+Used for search when the database is not Postgres, or when
+``PERSON_SEARCH_BACKEND=memory``. Four sorted key lists are kept, one per
+match tier, and results are ranked by tier, then alphabetically:
+
+    0  the name starts with the query
+    1  a later word of the name starts with it
+    2  the company starts with it
+    3  a later word of the company starts with it
+
+Each tier is a range found by bisection, so a query costs
+O(tiers * (log n + limit)). Persons created since the last load are read
+incrementally by id, at most every PERSON_SEARCH_REFRESH_SECONDS.
+"""
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import models
+
+REFRESH_SECONDS = float(os.environ.get("PERSON_SEARCH_REFRESH_SECONDS", "5"))
+LOAD_CHUNK_ROWS = 10000
+
+_WORD = re.compile(r"\w+")
+TIERS = 4
+
+
+def _keys(name, company):
+    """Yield ``(tier, key)`` for every searchable key of a person."""
+    for tier, value in ((0, name), (2, company)):
+        if not value:
+            continue
+        value = value.lower()
+        yield tier, value
+        words = _WORD.findall(value)
+        # The first word is already covered by the whole value.
+        if words and value.startswith(words[0]):
+            words = words[1:]
+        for word in dict.fromkeys(words):
+            yield tier + 1, word
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.persons = {}
+        self.last_id = 0
+        self.refreshed_at = None
+        # Parallel sorted lists per tier: keys and the person id of each key.
+        self._keys = [[] for _ in range(TIERS)]
+        self._ids = [array("q") for _ in range(TIERS)]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.persons)
+
+    def _bulk_add(self, rows):
+        entries = [[] for _ in range(TIERS)]
+        for person_id, name, company in rows:
+            self.persons[person_id] = (name, company)
+            for tier, key in _keys(name, company):
+                entries[tier].append((key, person_id))
+        for tier, new in enumerate(entries):
+            if len(new) > 1000 or not self._keys[tier]:
+                merged = sorted(list(zip(self._keys[tier], self._ids[tier])) + new)
+                self._keys[tier] = [key for key, _ in merged]
+                self._ids[tier] = array("q", (person_id for _, person_id in merged))
+                continue
+            for key, person_id in new:
+                at = bisect_left(self._keys[tier], key)
+                self._keys[tier].insert(at, key)
+                self._ids[tier].insert(at, person_id)
+
+    def add(self, person_id, name, company):
+        with self._lock:
+            if person_id not in self.persons:
+                self._bulk_add([(person_id, name, company)])
+
+    def refresh(self, db, force=False):
+        """Load persons added since the last refresh."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self.refreshed_at is not None and now - self.refreshed_at < REFRESH_SECONDS:
+                return
+            Person = models.Person
+            rows = (
+                db.query(Person.id, Person.name, Person.company)
+                .filter(Person.id > self.last_id)
+                .order_by(Person.id)
+                .yield_per(LOAD_CHUNK_ROWS)
+            )
+            rows = [tuple(row) for row in rows]
+            if rows:
+                self.last_id = rows[-1][0]
+            # Persons created through this process are already indexed by `add`.
+            self._bulk_add([row for row in rows if row[0] not in self.persons])
+            self.refreshed_at = now
+
+    def search(self, query, limit):
+        """Return up to `limit` ``(id, name, company)`` matches for `query`, best first."""
+        query = query.strip().lower()
+        results = {}
+        if not query:
+            return []
+        with self._lock:
+            self._collect(query, limit, results)
+        return [(person_id, name, company) for person_id, (name, company) in results.items()]
+
+    def _collect(self, query, limit, results):
+        for tier in range(TIERS):
+            keys, ids = self._keys[tier], self._ids[tier]
+            i = bisect_left(keys, query)
+            while i < len(keys) and len(results) < limit and keys[i].startswith(query):
+                person_id = ids[i]
+                if person_id not in results:
+                    results[person_id] = self.persons[person_id]
+                i += 1
+            if len(results) >= limit:
+                break
@@ -1,12 +1,123 @@
+import os
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-import models, schema
+import cache, migrate, models, schema, search, versions
+
+# Rows fetched per round trip from the server-side cursor when streaming.
+STREAM_CHUNK_ROWS = int(os.environ.get("PERSON_STREAM_CHUNK_ROWS", "1000"))
+
+# "postgres", "memory", or "auto" (postgres when the database is Postgres).
+SEARCH_BACKEND = os.environ.get("PERSON_SEARCH_BACKEND", "auto").lower()
+# Shortest query matched as a substring via trigrams; shorter ones are prefix-only.
+SEARCH_TRIGRAM_MIN_CHARS = 3
+
+_persons = cache.PersonCache()
+_version = versions.TableVersion(models.Person.id)
+_search_index = search.PrefixIndex()
+_trigram = None
+
+# Prefix matches come back in index order from the "C"-collation indexes.
+_PREFIX_SQL = {
+    column: text(
+        f"SELECT id, name, company FROM person WHERE lower({column}) COLLATE \"C\" LIKE :pattern "
+        f"ORDER BY lower({column}) COLLATE \"C\", id LIMIT :limit"
+    )
+    for column in ("name", "company")
+}
+# Substring matches, nearest trigram distance first, from the GiST indexes.
+_SUBSTRING_SQL = {
+    column: text(
+        f"SELECT id, name, company FROM person WHERE lower({column}) LIKE :pattern "
+        f"ORDER BY lower({column}) <-> :query, id LIMIT :limit"
+    )
+    for column in ("name", "company")
+}
 
 def create_person(db: Session, person: schema.PersonCreate):
     db_person = models.Person(name=person.name, company=person.company)
     db.add(db_person)
     db.commit()
+    _version.invalidate()
     db.refresh(db_person)
+    _persons.invalidate(db_person.id)
+    if _search_index.refreshed_at is not None:
+        _search_index.add(db_person.id, db_person.name, db_person.company)
     return db_person
 
+def get_persons_by_ids(db: Session, person_ids):
+    """Return the persons that exist among `person_ids` as PersonRead, keyed by id."""
+    found, missing = _persons.get_many(list(dict.fromkeys(person_ids)))
+    if missing:
+        rows = db.query(models.Person).filter(models.Person.id.in_(missing)).all()
+        persons = [schema.PersonRead.from_orm(row) for row in rows]
+        _persons.put_many(missing, persons)
+        found.update((person.id, person) for person in persons)
+    return found
+
+def get_person(db: Session, person_id: int):
+    return get_persons_by_ids(db, [person_id]).get(person_id)
+
+def get_cache_stats():
+    return _persons.stats()
+
+def get_list_version(db: Session):
+    return _version.get(db)
+
 def get_all_persons(db: Session):
     return db.query(models.Person).all()
+
+def get_persons_page(db: Session, after_id: int, limit: int):
+    return (
+        db.query(models.Person)
+        .filter(models.Person.id > after_id)
+        .order_by(models.Person.id)
+        .limit(limit)
+        .all()
+    )
+
+def iter_persons(db: Session, after_id: int = 0):
+    """Yield persons in id order through a server-side cursor."""
+    return (
+        db.query(models.Person)
+        .filter(models.Person.id > after_id)
+        .order_by(models.Person.id)
+        .yield_per(STREAM_CHUNK_ROWS)
+    )
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _search_postgres(db: Session, query: str, limit: int):
+    global _trigram
+    if _trigram is None:
+        _trigram = migrate.has_trigram(db.connection())
+    escaped = _escape_like(query)
+    statements = [(_PREFIX_SQL["name"], escaped + "%"), (_PREFIX_SQL["company"], escaped + "%")]
+    if _trigram and len(query) >= SEARCH_TRIGRAM_MIN_CHARS:
+        statements += [(_SUBSTRING_SQL["name"], "%" + escaped + "%"), (_SUBSTRING_SQL["company"], "%" + escaped + "%")]
+    results = {}
+    # Tiers in rank order, each an index scan stopped at `limit` rows.
+    for statement, pattern in statements:
+        for row in db.execute(statement, {"pattern": pattern, "query": query, "limit": limit}):
+            results.setdefault(row.id, row)
+        if len(results) >= limit:
+            break
+    return list(results.values())[:limit]
+
+def search_persons(db: Session, query: str, limit: int):
+    """Persons whose name or company matches `query`, best first.
+
+    Name prefix matches rank before company prefix matches, then (in Postgres
+    with pg_trgm) substring matches by trigram distance. The in-memory
+    backend matches prefixes of the whole value and of each word instead.
+    """
+    query = query.strip().lower()
+    if not query:
+        return []
+    postgres = db.bind.dialect.name == "postgresql"
+    if SEARCH_BACKEND == "postgres" or (SEARCH_BACKEND == "auto" and postgres):
+        rows = _search_postgres(db, query, limit)
+    else:
+        _search_index.refresh(db)
+        rows = _search_index.search(query, limit)
+    return [schema.PersonRead(id=row[0], name=row[1], company=row[2]) for row in rows]